@@ -5,16 +5,44 @@ Author:  Ian Fisher (iafisher@protonmail.com)
 Version: December 2019
 """
 import argparse
+import array
+import asyncio
 import bisect
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import heapq
+import io
+import itertools
+import json
 import math
+import mmap
+import multiprocessing
 import os
+import platform
 import random
+import re
 import readline
 import shutil
+import struct
 import sys
+import tempfile
 import textwrap
+import threading
 import time
+import tracemalloc
 import unittest
+from collections import namedtuple
+from queue import Empty
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is optional, and only needed for `solve_boards`.
+    np = None
 
 
 # Bazel orchestrates the runtime environment so that the dictionary files can be found
@@ -27,10 +55,38 @@ import unittest
 # instead.
 DICTIONARY_FOLDER = "fun/boggle/words"
 DICTIONARY_EN = os.path.join(DICTIONARY_FOLDER, "en_abridged.txt")
+DICTIONARY_EN_FULL = os.path.join(DICTIONARY_FOLDER, "en.txt")
 DICTIONARY_RU = os.path.join(DICTIONARY_FOLDER, "ru.txt")
+# Extension of dictionaries compiled with `--compile`.
+COMPILED_EXTENSION = ".trie"
+# A blank tile, which can stand for any tile.
+BLANK_TILE = "?"
 GAME_DURATION_IN_SECS = 3*60
 BOARD_SIDE_LENGTH = 4
 MIN_WORD_LENGTH = 3
+# Words at least this long count towards `Difficulty.min_long_words`.
+LONG_WORD_LENGTH = 6
+# Number of unsuccessful tile swaps after which `generate_board` starts over.
+GENERATE_MAX_STALLED = 50
+# Number of times `generate_board` starts over before giving up.
+GENERATE_MAX_RESTARTS = 100
+# Number of boards that a `BoardPool` keeps in reserve.
+POOL_SIZE = 10
+# Initial and final temperature of the simulated annealing in `anneal`, in points.
+ANNEAL_START_TEMPERATURE = 10.0
+ANNEAL_END_TEMPERATURE = 0.1
+# Number of seconds between progress reports from `anneal`.
+REPORT_INTERVAL_IN_SECS = 5
+# Number of boards that `solve_batch` reads ahead of the ones being solved.
+BATCH_READ_AHEAD = 10000
+# Number of boards whose solutions a `SolutionCache` keeps by default.
+CACHE_SIZE = 100000
+# Percentiles that `sample_boards` summarizes the distributions with.
+SAMPLE_PERCENTILES = (1, 5, 10, 25, 50, 75, 90, 95, 99, 100)
+# Number of boards that `solve_boards` solves at once.
+VECTOR_BATCH_SIZE = 256
+# Number of connections that `GameServer` lets wait to be accepted.
+SERVER_BACKLOG = 1024
 
 
 def main():
@@ -48,8 +104,122 @@ def main():
         "--size", type=int, default=BOARD_SIDE_LENGTH,
         help="Number of letters per side of board")
     parser.add_argument("--words", default="", help="Path to dictionary file.")
+    parser.add_argument(
+        "--blanks", type=int, default=0,
+        help=f"Number of blank tiles ({BLANK_TILE}), which stand for any letter.")
+    parser.add_argument(
+        "--min-score", type=int, default=1,
+        help="Minimum best possible score of the board.")
+    parser.add_argument(
+        "--max-score", type=int, default=None,
+        help="Maximum best possible score of the board.")
+    parser.add_argument(
+        "--min-long-words", type=int, default=0,
+        help=f"Minimum number of words of at least {LONG_WORD_LENGTH} letters.")
+    parser.add_argument(
+        "--pool", metavar="DIR",
+        help=(
+            "Keep boards solved in advance in DIR, so that the game starts instantly "
+            "even with demanding --min-score or --min-long-words values."
+        ))
+    parser.add_argument(
+        "--compile", nargs=2, metavar=("WORDS", "OUTPUT"),
+        help="Compile the dictionary file WORDS into OUTPUT and exit.")
+    parser.add_argument(
+        "--verbose", action="store_true",
+        help="Print diagnostic information, such as how long loading took.")
+    parser.add_argument(
+        "--solve-batch", metavar="PATH",
+        help=(
+            "Solve each board in PATH (one per line, or - for standard input) and "
+            "print the words and scores as JSON, one line per board."
+        ))
+    parser.add_argument(
+        "--cache", metavar="DIR",
+        help=(
+            "Keep the solutions of --solve-batch in DIR, and reuse them for boards "
+            "that are the same up to rotation and reflection."
+        ))
+    parser.add_argument(
+        "--optimize", action="store_true",
+        help=(
+            "Search for the highest-scoring board of the given --size by simulated "
+            "annealing, instead of playing."
+        ))
+    parser.add_argument(
+        "--restarts", type=int, default=None,
+        help="Number of independent searches for --optimize (default: --jobs).")
+    parser.add_argument(
+        "--iterations", type=int, default=None,
+        help="Number of tile changes to try in each search of --optimize.")
+    parser.add_argument(
+        "--time", type=float, default=None,
+        help="Number of seconds that each search of --optimize may run.")
+    parser.add_argument(
+        "--checkpoint", metavar="PATH",
+        help=(
+            "Save the best boards found by --optimize to PATH as they are found, and "
+            "start from the boards already saved there."
+        ))
+    parser.add_argument(
+        "--sample", type=int, metavar="N",
+        help=(
+            "Solve N random boards of the given --size and write the distribution of "
+            "their best possible scores, word counts and longest words to --output, "
+            "instead of playing."
+        ))
+    parser.add_argument(
+        "--jobs", type=int, default=os.cpu_count(),
+        help="Number of processes to use with --solve-batch, --optimize and --sample.")
+    parser.add_argument(
+        "--benchmark", action="store_true",
+        help="Run the benchmarks and print the results as JSON.")
+    parser.add_argument(
+        "--stats", action="store_true",
+        help=(
+            "Generate and solve a board, and print how much work each phase took as "
+            "JSON, instead of playing."
+        ))
+    parser.add_argument(
+        "--output", default="-",
+        help=(
+            "File to write the output of --solve-batch, --benchmark, --simulate, "
+            "--stats or --sample to, or - for standard output."
+        ))
+    parser.add_argument(
+        "--serve", metavar="ADDRESS",
+        help=(
+            "Host multiplayer games on ADDRESS, either HOST:PORT or the path of a "
+            "Unix socket, instead of playing."
+        ))
+    parser.add_argument(
+        "--simulate", metavar="ADDRESS",
+        help=(
+            "Measure the server at ADDRESS by simulating --players players and print "
+            "the results as JSON."
+        ))
+    parser.add_argument(
+        "--players", type=int, default=100,
+        help="Number of players for --simulate.")
+    parser.add_argument(
+        "--rooms", type=int, default=10,
+        help="Number of rooms to spread the players of --simulate across.")
+    parser.add_argument(
+        "--guesses", type=int, default=20,
+        help="Number of guesses that each player of --simulate makes.")
     args = parser.parse_args()
 
+    if args.compile:
+        compile_dictionary(*args.compile)
+        return
+
+    if args.benchmark:
+        results = run_benchmarks()
+        with open_for_batch(args.output, "w") as out:
+            json.dump(results, out, indent=2)
+            out.write("\n")
+        return
+
     if args.duration <= 0:
         sys.stderr.write("Error: --duration must be a positive integer.\n")
         sys.exit(1)
@@ -58,25 +228,215 @@ def main():
         sys.stderr.write("Error: --size must be at least 3.\n")
         sys.exit(1)
 
+    if not 0 <= args.blanks <= args.size * args.size:
+        sys.stderr.write("Error: --blanks must be between 0 and the number of tiles.\n")
+        sys.exit(1)
+
     if not args.words:
         if args.russian:
             args.words = DICTIONARY_RU
         else:
             args.words = DICTIONARY_EN
 
-    dct = open_dictionary(args.words)
-    best_possible_score = 0
-    while best_possible_score == 0:
-        # Loop until we find a board with at least 1 possible word.
-        board = Board(size=args.size, russian=args.russian)
-        all_possible_words = board.all_words(dct, min_length=args.min)
-        best_possible_score = sum(map(score, all_possible_words))
+    if not os.path.exists(args.words):
+        sys.stderr.write(f"Error: dictionary {args.words} not found.\n")
+        sys.exit(1)
+
+    if args.jobs <= 0:
+        sys.stderr.write("Error: --jobs must be a positive integer.\n")
+        sys.exit(1)
+
+    if args.optimize:
+        if args.iterations is None and args.time is None:
+            sys.stderr.write("Error: --optimize requires --iterations or --time.\n")
+            sys.exit(1)
+
+        if args.iterations is not None and args.iterations <= 0:
+            sys.stderr.write("Error: --iterations must be a positive integer.\n")
+            sys.exit(1)
+
+        if args.time is not None and args.time <= 0:
+            sys.stderr.write("Error: --time must be a positive number.\n")
+            sys.exit(1)
+
+        if args.restarts is not None and args.restarts <= 0:
+            sys.stderr.write("Error: --restarts must be a positive integer.\n")
+            sys.exit(1)
+
+        best_letters, best_score = optimize(
+            args.words, size=args.size, russian=args.russian, min_length=args.min,
+            restarts=args.restarts or args.jobs, jobs=args.jobs,
+            iterations=args.iterations, duration=args.time,
+            checkpoint=args.checkpoint,
+        )
+        Board.from_list(best_letters).display()
+        print(f"Score: {best_score}")
+        return
+
+    if args.sample is not None:
+        if args.sample <= 0:
+            sys.stderr.write("Error: --sample must be a positive integer.\n")
+            sys.exit(1)
+
+        # The distribution is saved as it is gathered unless it goes to standard
+        # output, where it is only printed at the end.
+        output = None if args.output == "-" else args.output
+        distribution = sample_boards(
+            args.words, args.sample, output, size=args.size, russian=args.russian,
+            min_length=args.min, jobs=args.jobs,
+        )
+        if output is None:
+            json.dump(distribution, sys.stdout, indent=2)
+            print()
+        return
+
+    if args.solve_batch:
+        cache = SolutionCache(args.words, min_length=args.min, directory=args.cache)
+        with open_for_batch(args.solve_batch, "r") as inp:
+            with open_for_batch(args.output, "w") as out:
+                try:
+                    solve_batch(
+                        read_boards(inp), args.words, out, jobs=args.jobs,
+                        min_length=args.min, cache=cache,
+                    )
+                except ValueError as e:
+                    sys.stderr.write(f"Error: {e}\n")
+                    sys.exit(1)
+        cache.save()
+        if args.verbose:
+            print(
+                f"Found {cache.hits} of {cache.hits + cache.misses} boards in the "
+                "cache.",
+                file=sys.stderr,
+            )
+        return
+
+    stats = SolverStats()
+    with stats.phase("load"):
+        trie = load_trie(args.words)
+    if args.verbose:
+        elapsed = stats.phases["load"]
+        print(
+            f"Loaded {len(trie.words)} words in {elapsed * 1000:.1f} ms.",
+            file=sys.stderr,
+        )
+
+    difficulty = Difficulty(args.min_score, args.max_score, args.min_long_words)
+    kwargs = dict(
+        size=args.size, russian=args.russian, min_length=args.min, blanks=args.blanks
+    )
+
+    if args.serve:
+        server = GameServer(trie, difficulty, duration=args.duration, **kwargs)
+        print(f"Serving games on {args.serve}.", file=sys.stderr)
+        try:
+            asyncio.run(server.serve(args.serve))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.simulate:
+        if min(args.players, args.rooms, args.guesses) <= 0:
+            sys.stderr.write(
+                "Error: --players, --rooms and --guesses must be positive integers.\n"
+            )
+            sys.exit(1)
+
+        try:
+            results = asyncio.run(simulate(
+                args.simulate, trie, players=args.players, rooms=args.rooms,
+                guesses=args.guesses, min_length=args.min,
+            ))
+        except (OSError, ValueError) as e:
+            sys.stderr.write(f"Error: {e}\n")
+            sys.exit(1)
+
+        with open_for_batch(args.output, "w") as out:
+            json.dump(results, out, indent=2)
+            out.write("\n")
+        return
+
+    pool = None
+    if args.pool:
+        pool = BoardPool(args.pool, args.words, trie, difficulty, **kwargs)
+
+    def new_game():
+        if pool is not None:
+            return pool.take()
+        else:
+            return generate_board(trie, difficulty, **kwargs)
+
+    try:
+        if args.stats or pool is not None or difficulty != Difficulty():
+            with stats.phase("generate"):
+                board, words = new_game()
+            solution = _resolved(words)
+        else:
+            # Any board with a word will do, so show one right away and solve it
+            # while the player gets started. Finding the first word is quick.
+            for _ in range(GENERATE_MAX_RESTARTS):
+                board = Board(size=args.size, russian=args.russian, blanks=args.blanks)
+                if board.has_words(trie, min_length=args.min):
+                    break
+            else:
+                raise ValueError("could not generate a board with any words")
+            solution = run_in_background(board.all_words, trie, min_length=args.min)
+    except ValueError as e:
+        sys.stderr.write(f"Error: {e}\n")
+        sys.exit(1)
+
+    if args.stats:
+        board.all_words(trie, min_length=args.min, stats=stats)
+        with open_for_batch(args.output, "w") as out:
+            json.dump(
+                dict(board="".join(board.letters), **stats.as_dict()), out,
+                ensure_ascii=False, indent=2,
+            )
+            out.write("\n")
+        return
+
+    while True:
+        if pool is not None:
+            # Taking a board from the pool is instant, so there is no need to take
+            # the next one before the player asks for it.
+            pool.refill_in_background()
+            next_game = None
+        else:
+            next_game = run_in_background(_after, solution, new_game)
 
+        play_game(board, solution, trie, duration=args.duration, min_length=args.min)
+
+        print()
+        try:
+            again = input("Play again? [y/N] ").strip().lower()
+        except (KeyboardInterrupt, EOFError):
+            print()
+            break
+
+        if again not in ("y", "yes"):
+            break
+
+        try:
+            board, words = next_game.result() if next_game is not None else new_game()
+        except ValueError as e:
+            sys.stderr.write(f"Error: {e}\n")
+            sys.exit(1)
+        solution = _resolved(words)
+
+
+def play_game(board, solution, trie, *, duration, min_length=MIN_WORD_LENGTH):
+    """
+    Play a game of `duration` seconds on `board` at the terminal.
+
+    `solution` is a Future of the set of the board's words, which may still be
+    running. Until it is done, guesses are checked with `board` and `trie` instead;
+    only the score waits for it.
+    """
     board.display()
     print("Enter !p to print the board again.")
     print()
     start = now()
-    end = time_add(start, args.duration)
+    end = time_add(start, duration)
     your_words = set()
     your_score = 0
     while True:
@@ -99,33 +459,29 @@ def main():
         if response == "!p":
             board.display()
         elif response == "!s":
-            perc = your_score / best_possible_score
-            print(f"{your_score} / {best_possible_score} ({perc:.1%})")
+            print(_format_score(your_score, solution.result()))
         elif response == "!ps" or response == "!sp":
             board.display()
-            perc = your_score / best_possible_score
-            print(f"{your_score} / {best_possible_score} ({perc:.1%})")
+            print(_format_score(your_score, solution.result()))
         elif response:
             if response in your_words:
                 print("You already said that.")
             else:
-                if len(response) < args.min:
-                    print(f"Too short. (minimum length: {args.min})")
-                    continue
-
-                if not board.check(response):
-                    print("Not on the board.")
-                    continue
-
-                if not check_dictionary(dct, response):
-                    print("Not in dictionary.")
+                words = solution.result() if solution.done() else None
+                message = check_guess(
+                    board, words, response, min_length=min_length, trie=trie
+                )
+                if message is not None:
+                    print(message)
                     continue
 
                 your_words.add(response)
                 your_score += score(response)
 
+    all_possible_words = solution.result()
+    best_possible_score = sum(map(score, all_possible_words))
     missed = sorted(all_possible_words - your_words)
-    perc = your_score / best_possible_score
+    perc = your_score / best_possible_score if best_possible_score else 0.0
     print()
     print(f"Your score:         {your_score}")
     print(f"Max possible score: {best_possible_score}")
@@ -135,6 +491,1280 @@ def main():
     print(textwrap.fill("MISSED: " + ", ".join(missed), width=width))
 
 
+def _format_score(your_score, words):
+    best_possible_score = sum(map(score, words))
+    perc = your_score / best_possible_score if best_possible_score else 0.0
+    return f"{your_score} / {best_possible_score} ({perc:.1%})"
+
+
+def run_in_background(f, *args, **kwargs):
+    """
+    Call `f(*args, **kwargs)` on a background thread, and return a
+    `concurrent.futures.Future` of the result.
+
+    The thread is a daemon, so it doesn't keep the program running once the main
+    thread is done.
+    """
+    future = concurrent.futures.Future()
+
+    def run():
+        try:
+            future.set_result(f(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return future
+
+
+def _resolved(value):
+    future = concurrent.futures.Future()
+    future.set_result(value)
+    return future
+
+
+def _after(future, f):
+    # Wait for `future` first, so that the two don't compete for the interpreter.
+    future.exception()
+    return f()
+
+
+def solve_boards(trie, boards, *, min_length=MIN_WORD_LENGTH):
+    """
+    Return a list of the sets of words of each of `boards`, which must all be the
+    same size, like calling `all_words` on each of them but much faster for many
+    boards. This requires NumPy.
+
+    Instead of searching one board and one path at a time, this keeps every path on
+    every board that spells the prefix of some word in NumPy arrays, and extends all
+    of them by one tile at a time, looking up the next nodes in the trie's table of
+    transitions (see `Trie.transitions`). The interpreter's overhead is then paid
+    once per step for all the boards together, instead of once per path.
+
+    Boards with blank tiles are solved with `all_words`.
+    """
+    if np is None:
+        raise ImportError("solve_boards requires NumPy")
+    if len({board.size for board in boards}) > 1:
+        raise ValueError("boards must all be the same size")
+
+    results = [None] * len(boards)
+    batch = []
+    for i, board in enumerate(boards):
+        if BLANK_TILE in board.letters:
+            results[i] = board.all_words(trie, min_length=min_length)
+        else:
+            batch.append(i)
+
+    # Solve the boards a limited number at a time, as the memory needed grows with the
+    # number of paths.
+    for start in range(0, len(batch), VECTOR_BATCH_SIZE):
+        indices = batch[start:start+VECTOR_BATCH_SIZE]
+        words = _solve_boards([boards[i] for i in indices], trie, min_length)
+        for i, board_words in zip(indices, words):
+            results[i] = board_words
+    return results
+
+
+def _solve_boards(boards, trie, min_length):
+    if not boards:
+        return []
+
+    table = trie.transitions()
+    unknown = table.shape[1] - 1
+    size = boards[0].size
+    cells = size * size
+    codes = np.array(
+        [trie.alphabet.encode(board.letters) for board in boards], dtype=np.intp
+    )
+    codes[codes > unknown] = unknown
+
+    # The neighbors of each cell, padded with -1.
+    neighbors = np.full((cells, 8), -1, dtype=np.intp)
+    for i, adjacent in enumerate(boards[0].neighbors):
+        neighbors[i, :len(adjacent)] = adjacent
+    lengths = np.frombuffer(trie.alphabet.lengths, dtype=np.uint8).astype(np.intp)
+    word_ids = np.frombuffer(trie.word_ids, dtype=np.int32)
+
+    # The paths are held in parallel arrays: the board each is on, the cell it ends
+    # at, its node in the trie, its length in letters, and the cells it has visited,
+    # as bitmasks of 64 cells each.
+    board = np.repeat(np.arange(len(boards)), cells)
+    cell = np.tile(np.arange(cells), len(boards))
+    node = table[Trie.ROOT, codes[board, cell]]
+    alive = node != -1
+    board, cell, node = board[alive], cell[alive], node[alive]
+    length = lengths[codes[board, cell]]
+    visited = np.zeros((len(board), (cells + 63) // 64), dtype=np.uint64)
+    visited[np.arange(len(board)), cell // 64] = _bits(cell)
+
+    found = []
+    while len(board):
+        ids = word_ids[node]
+        is_word = (ids != -1) & (length >= min_length)
+        found.append(board[is_word] * len(trie.words) + ids[is_word])
+
+        # Extend every path to every neighbor it hasn't visited, and keep the new
+        # paths that are still prefixes of words.
+        path, k = np.nonzero(neighbors[cell] != -1)
+        next_cell = neighbors[cell[path], k]
+        free = (visited[path, next_cell // 64] & _bits(next_cell)) == 0
+        path, next_cell = path[free], next_cell[free]
+        code = codes[board[path], next_cell]
+        next_node = table[node[path], code]
+        alive = next_node != -1
+        path, next_cell, code = path[alive], next_cell[alive], code[alive]
+
+        visited = visited[path]
+        visited[np.arange(len(path)), next_cell // 64] |= _bits(next_cell)
+        board = board[path]
+        cell = next_cell
+        node = next_node[alive]
+        length = length[path] + lengths[code]
+
+    results = [set() for _ in boards]
+    if not found:
+        # No path survived the first step.
+        return results
+
+    for key in np.unique(np.concatenate(found)).tolist():
+        i, word_id = divmod(key, len(trie.words))
+        results[i].add(trie.words[word_id])
+    return results
+
+
+def _bits(cells):
+    """Return the bit of each of `cells` in its 64-bit word of a bitmask."""
+    return np.left_shift(np.uint64(1), (cells % 64).astype(np.uint64))
+
+
+def solve_batch(
+    boards, path, output, *, jobs, min_length=MIN_WORD_LENGTH, cache=None,
+):
+    """
+    Solve each of `boards` with the dictionary at `path` and write the results to the
+    file object `output`, as one line of JSON per board, in order.
+
+    The boards are solved by a pool of `jobs` processes, each of which loads the
+    dictionary once when it starts. `boards` may be an arbitrarily long iterator, as
+    only a bounded number of boards is read ahead at a time.
+
+    A board that is a rotation or reflection of one already solved isn't solved
+    again. The solutions are kept in `cache`, a `SolutionCache`, if one is given.
+    """
+    if cache is None:
+        cache = SolutionCache(path, min_length=min_length)
+
+    if jobs == 1:
+        _init_worker(path, min_length)
+        for board in boards:
+            words = cache.words(board, _worker_trie)
+            output.write(_format_solution(board.letters, words))
+        return
+
+    with multiprocessing.Pool(
+        jobs, initializer=_init_worker, initargs=(path, min_length)
+    ) as pool:
+        while True:
+            chunk = list(itertools.islice(boards, BATCH_READ_AHEAD))
+            if not chunk:
+                break
+
+            # Solve each board that isn't cached once, however many times it (or a
+            # symmetry of it) comes up in the chunk.
+            solutions = [cache.get(board) for board in chunk]
+            unsolved = {}
+            for board, words in zip(chunk, solutions):
+                if words is None:
+                    unsolved.setdefault(board.canonical(), board)
+
+            # Send the boards to the workers in groups of the same size, so that they
+            # can be solved together.
+            by_size = {}
+            for board in unsolved.values():
+                by_size.setdefault(board.size, []).append(board)
+            groups = [
+                boards[i:i+VECTOR_BATCH_SIZE]
+                for boards in by_size.values()
+                for i in range(0, len(boards), VECTOR_BATCH_SIZE)
+            ]
+            results = pool.imap(
+                _solve_for_batch,
+                [[board.letters for board in group] for group in groups],
+            )
+            solved = {}
+            for group, group_words in zip(groups, results):
+                for board, words in zip(group, group_words):
+                    solved[board.canonical()] = words
+                    cache.put(board, words)
+
+            for board, words in zip(chunk, solutions):
+                if words is None:
+                    words = solved[board.canonical()]
+                output.write(_format_solution(board.letters, words))
+
+
+def read_boards(lines):
+    """
+    Yield the board on each nonblank line of `lines`, which are parsed one at a time
+    with `Board.from_string`. A line that isn't a board is skipped with a warning on
+    standard error, so that it doesn't stop the boards around it from being solved.
+    """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            yield Board.from_string(line)
+        except ValueError as e:
+            sys.stderr.write(f"Warning: skipping line {number}: {e}\n")
+
+
+# The state of a worker process of `solve_batch` or `optimize`.
+_worker_trie = None
+_worker_min_length = MIN_WORD_LENGTH
+_worker_report = None
+
+
+def _init_worker(path, min_length, report=None):
+    global _worker_trie, _worker_min_length, _worker_report
+    _worker_trie = load_trie(path)
+    _worker_min_length = min_length
+    _worker_report = report
+
+
+def _solve_for_batch(letters_list):
+    boards = [Board.from_list(letters) for letters in letters_list]
+    return [frozenset(words) for words in _solve_all(boards)]
+
+
+def _solve_all(boards):
+    """
+    Return the words of each of `boards`, which must all be the same size, with the
+    worker's dictionary.
+    """
+    if np is not None:
+        return solve_boards(_worker_trie, boards, min_length=_worker_min_length)
+    else:
+        return [
+            board.all_words(_worker_trie, min_length=_worker_min_length)
+            for board in boards
+        ]
+
+
+def _format_solution(letters, words):
+    result = {
+        "board": "".join(letters),
+        "score": sum(map(score, words)),
+        "words": sorted(words),
+    }
+    return json.dumps(result, ensure_ascii=False) + "\n"
+
+
+def anneal(
+    trie, board, *, iterations=None, deadline=None, min_length=MIN_WORD_LENGTH,
+    report=None,
+):
+    """
+    Search for the highest-scoring board by simulated annealing, starting from `board`
+    and changing it in place.
+
+    At each step, either a tile is changed to another letter or two tiles are
+    swapped. Changes that raise the score are always kept, and changes that lower it
+    are kept with a probability that shrinks as the search goes on. The search stops
+    after `iterations` steps or once `now()` reaches `deadline`, whichever is first.
+
+    Every REPORT_INTERVAL_IN_SECS seconds, and whenever a new best board is found,
+    `report(best_letters, best_score, evaluations, elapsed)` is called if `report` is
+    not None.
+
+    Return the best letters found, their score, and the number of boards evaluated.
+    """
+    if iterations is None and deadline is None:
+        raise ValueError("anneal needs a number of iterations or a deadline")
+    if iterations is not None and iterations <= 0:
+        raise ValueError("iterations must be positive")
+
+    alphabet = sorted(set(board.LETTERS if board.english else board.LETTERS_RU))
+    start = now()
+    last_report = start
+    board.solve(trie, min_length=min_length)
+    current = board.best_score
+    best_letters, best_score = list(board.letters), current
+    evaluations = 0
+    while True:
+        progress = 0.0
+        if iterations is not None:
+            progress = evaluations / iterations
+        if deadline is not None:
+            t = now()
+            progress = max(progress, (t - start) / max(deadline - start, 1e-9))
+        if progress >= 1.0:
+            break
+
+        temperature = ANNEAL_START_TEMPERATURE * (
+            (ANNEAL_END_TEMPERATURE / ANNEAL_START_TEMPERATURE) ** progress
+        )
+        i = random.randrange(len(board.letters))
+        if random.random() < 0.5:
+            j = random.randrange(len(board.letters))
+            changes = [(i, board.letters[j]), (j, board.letters[i])]
+        else:
+            changes = [(i, random.choice(alphabet))]
+
+        undo = [(index, board.letters[index]) for index, _ in changes]
+        for index, letter in changes:
+            board.replace(index, letter)
+        evaluations += 1
+
+        delta = board.best_score - current
+        if delta >= 0 or random.random() < math.exp(delta / temperature):
+            current = board.best_score
+        else:
+            for index, letter in reversed(undo):
+                board.replace(index, letter)
+
+        improved = current > best_score
+        if improved:
+            best_letters, best_score = list(board.letters), current
+
+        if report is not None:
+            t = now()
+            if improved or time_diff(t, last_report) >= REPORT_INTERVAL_IN_SECS:
+                report(best_letters, best_score, evaluations, time_diff(t, start))
+                last_report = t
+
+    return best_letters, best_score, evaluations
+
+
+def optimize(
+    path, *, size=BOARD_SIDE_LENGTH, russian=False, min_length=MIN_WORD_LENGTH,
+    restarts=1, jobs=1, iterations=None, duration=None, checkpoint=None,
+):
+    """
+    Run `restarts` independent searches with `anneal` for the highest-scoring board of
+    side `size`, using the dictionary at `path` and `jobs` processes. Each search
+    runs for `iterations` steps or `duration` seconds.
+
+    Progress is reported on standard error. If `checkpoint` is not None, the best
+    board of each search is saved there as soon as it is found, and searches start
+    from the best boards of side `size` already saved there, if any. A saved board is
+    only replaced by a better one from the search that started from it, and the other
+    saved boards (of other sizes, or beyond the first `restarts`) are kept.
+
+    Return the letters of the best board and its score.
+    """
+    # The (letters, score) pairs of every board in the checkpoint, and a map from each
+    # search to the index of its entry.
+    entries = []
+    if checkpoint is not None and os.path.exists(checkpoint):
+        with open(checkpoint, "r", encoding="utf-8") as f:
+            entries = [
+                (Board.from_string(entry["board"]).letters, entry["score"])
+                for entry in json.load(f)["boards"]
+            ]
+    same_size = [
+        i for i, (letters, _) in enumerate(entries) if len(letters) == size * size
+    ]
+    slots = dict(enumerate(same_size[:restarts]))
+
+    tasks = [
+        (restart, entries[slots[restart]][0] if restart in slots else None, size,
+         russian, iterations, duration)
+        for restart in range(restarts)
+    ]
+    best = {}
+    last_printed = {}
+
+    def handle(message):
+        restart, letters, best_score, evaluations, elapsed = message
+        t = now()
+        if time_diff(t, last_printed.get(restart, 0)) >= REPORT_INTERVAL_IN_SECS:
+            rate = evaluations / elapsed if elapsed > 0 else 0
+            sys.stderr.write(
+                f"search {restart}: best score {best_score}, {evaluations} evaluations "
+                f"({rate:.0f}/s)\n"
+            )
+            last_printed[restart] = t
+
+        if restart not in best or best_score > best[restart][1]:
+            best[restart] = (letters, best_score)
+            if checkpoint is None:
+                return
+
+            if restart not in slots:
+                slots[restart] = len(entries)
+                entries.append((letters, best_score))
+            elif best_score > entries[slots[restart]][1]:
+                entries[slots[restart]] = (letters, best_score)
+            else:
+                return
+            _write_checkpoint(checkpoint, entries)
+
+    if jobs == 1:
+        _init_worker(path, min_length, handle)
+        for task in tasks:
+            message = _anneal_for_optimize(task)
+            last_printed.pop(task[0], None)
+            handle(message)
+    else:
+        queue = multiprocessing.Queue()
+        with multiprocessing.Pool(
+            min(jobs, restarts), initializer=_init_worker,
+            initargs=(path, min_length, queue.put),
+        ) as pool:
+            result = pool.map_async(_anneal_for_optimize, tasks, chunksize=1)
+            while not result.ready() or not queue.empty():
+                try:
+                    handle(queue.get(timeout=0.1))
+                except Empty:
+                    pass
+
+            for message in result.get():
+                # Always print the final result of each search.
+                last_printed.pop(message[0], None)
+                handle(message)
+
+    return max(best.values(), key=lambda entry: entry[1])
+
+
+def _anneal_for_optimize(task):
+    restart, letters, size, russian, iterations, duration = task
+    board = Board(size=size, russian=russian)
+    if letters is not None:
+        board.letters = list(letters)
+
+    def report(*args):
+        _worker_report((restart,) + args)
+
+    deadline = time_add(now(), duration) if duration is not None else None
+    start = now()
+    best_letters, best_score, evaluations = anneal(
+        _worker_trie, board, iterations=iterations, deadline=deadline,
+        min_length=_worker_min_length, report=report,
+    )
+    return restart, best_letters, best_score, evaluations, time_diff(now(), start)
+
+
+def _write_checkpoint(path, entries):
+    boards = [
+        {"board": "".join(letters), "score": best_score}
+        for letters, best_score in sorted(entries, key=lambda entry: -entry[1])
+    ]
+    with _atomic_write(path) as f:
+        json.dump({"boards": boards}, f, ensure_ascii=False, indent=2)
+
+
+def sample_boards(
+    path, n, output=None, *, size=BOARD_SIDE_LENGTH, russian=False,
+    min_length=MIN_WORD_LENGTH, jobs=1,
+):
+    """
+    Solve `n` random boards with the dictionary at `path`, and return the distribution
+    of their best possible scores, numbers of words and longest words.
+
+    The boards are solved by a pool of `jobs` processes. Only histograms of the
+    results are kept, so memory use doesn't grow with `n`. If `output` is a path, the
+    distribution so far is saved there every REPORT_INTERVAL_IN_SECS seconds and at
+    the end.
+    """
+    histograms = {
+        "score": collections.Counter(),
+        "words": collections.Counter(),
+        "longest_word": collections.Counter(),
+    }
+    sampled = 0
+    last_report = now()
+
+    def record(result):
+        nonlocal sampled, last_report
+        for name, value in zip(histograms, result):
+            histograms[name][value] += 1
+        sampled += 1
+        elapsed = time_diff(now(), last_report)
+        if output is not None and elapsed >= REPORT_INTERVAL_IN_SECS:
+            distribution = _distribution(histograms, sampled, size, russian)
+            _write_distribution(output, distribution)
+            last_report = now()
+
+    # Each board gets its own seed, so that the workers don't all generate the same
+    # boards, and the results only depend on the state of `random` in this process.
+    # Each task is a group of boards, so that they can be solved together.
+    seed = random.getrandbits(64)
+    tasks = (
+        (seed + i, min(VECTOR_BATCH_SIZE, n - i), size, russian)
+        for i in range(0, n, VECTOR_BATCH_SIZE)
+    )
+    if jobs == 1:
+        _init_worker(path, min_length)
+        for task in tasks:
+            for result in _sample_boards(task):
+                record(result)
+    else:
+        with multiprocessing.Pool(
+            jobs, initializer=_init_worker, initargs=(path, min_length)
+        ) as pool:
+            groups = BATCH_READ_AHEAD // VECTOR_BATCH_SIZE
+            while True:
+                chunk = list(itertools.islice(tasks, groups))
+                if not chunk:
+                    break
+
+                for results in pool.imap_unordered(_sample_boards, chunk):
+                    for result in results:
+                        record(result)
+
+    distribution = _distribution(histograms, sampled, size, russian)
+    if output is not None:
+        _write_distribution(output, distribution)
+    return distribution
+
+
+def _sample_boards(task):
+    seed, n, size, russian = task
+    # `Board` draws from the global generator, so reseed it for each board and then
+    # put back its state, which belongs to the caller when `jobs` is 1.
+    state = random.getstate()
+    boards = []
+    try:
+        for i in range(n):
+            random.seed(seed + i)
+            boards.append(Board(size=size, russian=russian))
+    finally:
+        random.setstate(state)
+
+    return [
+        (sum(map(score, words)), len(words), max(map(len, words), default=0))
+        for words in _solve_all(boards)
+    ]
+
+
+def _distribution(histograms, sampled, size, russian):
+    return {
+        "boards": sampled,
+        "size": size,
+        "russian": russian,
+        "histograms": {
+            name: dict(sorted(histogram.items()))
+            for name, histogram in histograms.items()
+        },
+        "percentiles": {
+            name: {
+                f"p{percent}": _histogram_percentile(histogram, percent)
+                for percent in SAMPLE_PERCENTILES
+            }
+            for name, histogram in histograms.items()
+        },
+        "mean": {
+            name: sum(value * count for value, count in histogram.items())
+            / max(sampled, 1)
+            for name, histogram in histograms.items()
+        },
+    }
+
+
+def _write_distribution(path, distribution):
+    with _atomic_write(path) as f:
+        json.dump(distribution, f, indent=2)
+        f.write("\n")
+
+
+def _histogram_percentile(histogram, percent):
+    """
+    Return the `percent` percentile of the values counted in the Counter `histogram`,
+    or 0 if it is empty.
+    """
+    total = sum(histogram.values())
+    rank = max(math.ceil(total * percent / 100), 1)
+    seen = 0
+    for value in sorted(histogram):
+        seen += histogram[value]
+        if seen >= rank:
+            return value
+    return 0
+
+
+def open_for_batch(path, mode):
+    """Open `path` in `mode`, treating - as standard input or output."""
+    if path == "-":
+        stream = sys.stdin if "r" in mode else sys.stdout
+        # Don't close the standard streams when we're done with them.
+        return open(stream.fileno(), mode, encoding="utf-8", closefd=False)
+    else:
+        return open(path, mode, encoding="utf-8")
+
+
+@contextlib.contextmanager
+def _atomic_write(path):
+    """
+    Open a temporary file next to `path` for writing text, and rename it to `path` at
+    the end of the `with` block, so that `path` is never left half-written.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        yield f
+    os.replace(tmp, path)
+
+
+class Difficulty(
+    namedtuple("Difficulty", ["min_score", "max_score", "min_long_words"])
+):
+    """
+    A band of difficulty for boards: the best possible score must be at least
+    `min_score` and, unless it is None, at most `max_score`, and the board must have
+    at least `min_long_words` words of at least LONG_WORD_LENGTH letters.
+    """
+
+    def distance(self, words):
+        """
+        Return how far a board whose possible words are `words` is from the band, or 0
+        if it is within the band.
+        """
+        total = sum(map(score, words))
+        long_words = sum(1 for word in words if len(word) >= LONG_WORD_LENGTH)
+        distance = max(self.min_score - total, 0)
+        if self.max_score is not None:
+            distance += max(total - self.max_score, 0)
+        # Each missing long word counts as much as the score of a long word.
+        missing = max(self.min_long_words - long_words, 0)
+        distance += missing * score("x" * LONG_WORD_LENGTH)
+        return distance
+
+
+Difficulty.__new__.__defaults__ = (1, None, 0)
+
+
+def generate_board(
+    trie, difficulty=Difficulty(), *, size=BOARD_SIDE_LENGTH, russian=False,
+    min_length=MIN_WORD_LENGTH, blanks=0,
+):
+    """
+    Return a board in the `difficulty` band, and the set of its words.
+
+    Instead of generating random boards until one happens to fall in the band, this
+    starts from a random board and repeatedly swaps one of its tiles for a random tile
+    left in the bag, keeping the swap unless it moves the board further from the
+    band. This reaches boards that are much harder (or easier) than average far more
+    quickly. If the search stalls, it starts over from a new random board, and it
+    raises ValueError if it can't find a suitable board at all.
+
+    The board has `blanks` blank tiles, which stay where they are.
+    """
+    for _ in range(GENERATE_MAX_RESTARTS):
+        board = Board(size=size, russian=russian, blanks=blanks)
+        bag = collections.Counter(Board.bag(size, russian=russian))
+        bag.subtract(board.letters)
+        # Blanks aren't in the bag, and `elements` skips their negative count.
+        bag = list(bag.elements())
+
+        cells = [i for i, tile in enumerate(board.letters) if tile != BLANK_TILE]
+
+        board.solve(trie, min_length=min_length)
+        distance = difficulty.distance(board.words)
+        stalled = 0
+        while distance > 0 and bag and stalled < GENERATE_MAX_STALLED:
+            i = random.choice(cells)
+            j = random.randrange(len(bag))
+            old_letter = board.letters[i]
+            board.replace(i, bag[j])
+
+            new_distance = difficulty.distance(board.words)
+            if new_distance <= distance:
+                stalled = stalled + 1 if new_distance == distance else 0
+                bag[j] = old_letter
+                distance = new_distance
+            else:
+                board.replace(i, old_letter)
+                stalled += 1
+
+        if distance == 0:
+            return board, set(board.words)
+
+    raise ValueError("could not generate a board of the requested difficulty")
+
+
+class BoardPool:
+    """
+    A reserve of boards in a given difficulty band, generated and solved in advance and
+    kept on disk so that a game can start as soon as the program does.
+
+    Each combination of dictionary, board size, alphabet, minimum word length,
+    difficulty and number of blanks has its own file in the pool's directory, with one
+    board per line. The dictionary is identified as in `SolutionCache`.
+    """
+
+    def __init__(
+        self, directory, dictionary, trie, difficulty=Difficulty(), *,
+        size=BOARD_SIDE_LENGTH, russian=False, min_length=MIN_WORD_LENGTH, blanks=0,
+    ):
+        self.trie = trie
+        self.difficulty = difficulty
+        self.size = size
+        self.russian = russian
+        self.min_length = min_length
+        self.blanks = blanks
+        self.lock = threading.Lock()
+
+        self.path = _settings_path(
+            directory, dictionary, size, russian, min_length, list(difficulty), blanks,
+        )
+
+    def take(self):
+        """
+        Remove a board from the pool and return it with the set of its words. If the
+        pool is empty, a new board is generated instead.
+        """
+        with self.lock:
+            entries = self._read()
+            if entries:
+                self._write(entries[1:])
+                board = Board.from_list(entries[0]["board"], russian=self.russian)
+                return board, set(entries[0]["words"])
+
+        return self._generate()
+
+    def refill(self):
+        """Generate boards until the pool is full."""
+        while True:
+            with self.lock:
+                if len(self._read()) >= POOL_SIZE:
+                    return
+
+            board, words = self._generate()
+            entry = {"board": board.letters, "words": sorted(words)}
+            with self.lock:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def refill_in_background(self):
+        """
+        Refill the pool on a background thread. Boards are saved as soon as they are
+        generated, so the work isn't lost if the program exits first.
+        """
+        thread = threading.Thread(target=self.refill, daemon=True)
+        thread.start()
+        return thread
+
+    def __len__(self):
+        with self.lock:
+            return len(self._read())
+
+    def _generate(self):
+        return generate_board(
+            self.trie, self.difficulty, size=self.size, russian=self.russian,
+            min_length=self.min_length, blanks=self.blanks,
+        )
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # The program may have exited while a line was being written.
+                continue
+        return entries
+
+    def _write(self, entries):
+        with _atomic_write(self.path) as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class SolutionCache:
+    """
+    A bounded cache of the words of boards, shared by boards that are rotations or
+    reflections of each other, which have the same words.
+
+    The cache holds the solutions of at most `capacity` boards for one dictionary
+    and minimum word length, and forgets the least recently used boards first. If
+    `directory` is given, `save` writes the cache there, in a file of its own for
+    each dictionary and minimum word length, and it is loaded again from there. The
+    dictionary is identified by its absolute path, size and modification time, so
+    the solutions are not reused once it changes.
+    """
+
+    def __init__(
+        self, dictionary, *, min_length=MIN_WORD_LENGTH, capacity=CACHE_SIZE,
+        directory=None,
+    ):
+        self.min_length = min_length
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        # Map from canonical letters to words, in order from least to most recently
+        # used.
+        self.entries = collections.OrderedDict()
+
+        self.path = None
+        if directory is not None:
+            self.path = _settings_path(directory, dictionary, min_length)
+            self._read()
+
+    def get(self, board):
+        """Return the words of `board` as a frozenset, or None if they aren't cached."""
+        letters = board.canonical()
+        words = self.entries.get(letters)
+        if words is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(letters)
+        return words
+
+    def put(self, board, words):
+        self._put(board.canonical(), frozenset(words))
+
+    def words(self, board, trie):
+        """Return the words of `board` as a frozenset, solving it if necessary."""
+        words = self.get(board)
+        if words is None:
+            words = frozenset(board.all_words(trie, min_length=self.min_length))
+            self.put(board, words)
+        return words
+
+    def save(self):
+        """Save the cache to its directory, if it has one."""
+        if self.path is None:
+            return
+
+        with _atomic_write(self.path) as f:
+            for letters, words in self.entries.items():
+                entry = {"board": letters, "words": sorted(words)}
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _put(self, letters, words):
+        self.entries[letters] = words
+        self.entries.move_to_end(letters)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._put(tuple(entry["board"]), frozenset(entry["words"]))
+        except FileNotFoundError:
+            pass
+
+
+def _settings_path(directory, dictionary, *settings):
+    """
+    Return the path of the file in `directory` (which is created if need be) for the
+    dictionary at `dictionary` and the JSON-serializable `settings`.
+
+    The dictionary is identified by its absolute path, size and modification time, so
+    that dictionaries with the same name, and edited dictionaries, get files of their
+    own.
+    """
+    info = os.stat(dictionary)
+    key = json.dumps(
+        [os.path.abspath(dictionary), info.st_size, info.st_mtime_ns, *settings]
+    )
+    name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".jsonl"
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+class GameServer:
+    """
+    Hosts any number of concurrent multiplayer games in one process, all played with
+    one dictionary.
+
+    Clients speak a line-based protocol. The first line a client sends is
+    "JOIN <room> <name>", and every line after that is a guess, or !s to ask for the
+    scores. The server answers each nonempty line with one line of JSON. All the
+    players in a room play on the same board: the game starts when the first player
+    joins and ends `duration` seconds later, when every player is sent the final
+    scores and disconnected.
+
+    `close` ends every game and disconnects every client, and `serve` calls it when
+    it's cancelled.
+    """
+
+    def __init__(
+        self, trie, difficulty=Difficulty(), *, duration=GAME_DURATION_IN_SECS,
+        size=BOARD_SIDE_LENGTH, russian=False, min_length=MIN_WORD_LENGTH, blanks=0,
+    ):
+        self.trie = trie
+        self.difficulty = difficulty
+        self.duration = duration
+        self.size = size
+        self.russian = russian
+        self.min_length = min_length
+        self.blanks = blanks
+        self.rooms = {}
+        # Map from the name of a room whose board is being generated to the task that
+        # creates it, so that players who join meanwhile wait for the same room.
+        self.pending = {}
+        # The tasks that handle the connected clients, and their connections.
+        self.handlers = set()
+        self.writers = set()
+
+    async def start(self, address):
+        """
+        Start listening on `address`, either "HOST:PORT" or the path of a Unix socket,
+        and return the `asyncio.Server`.
+        """
+        host, port, path = parse_address(address)
+        if path is not None:
+            return await asyncio.start_unix_server(
+                self.handle, path, backlog=SERVER_BACKLOG
+            )
+        else:
+            return await asyncio.start_server(
+                self.handle, host, port, backlog=SERVER_BACKLOG
+            )
+
+    async def serve(self, address):
+        """Serve clients on `address` until cancelled, and then `close`."""
+        server = await self.start(address)
+        try:
+            # The server is already serving, so just wait to be cancelled.
+            await asyncio.get_running_loop().create_future()
+        finally:
+            server.close()
+            await self.close()
+            await server.wait_closed()
+
+    async def close(self):
+        """
+        End every game without sending the results, disconnect every client, and wait
+        for their handlers to finish.
+        """
+        for room in list(self.rooms.values()):
+            room.timer.cancel()
+            room._close()
+        for writer in self.writers:
+            writer.close()
+        # Closing the connections ends the handlers' reads, so they finish by
+        # themselves rather than being cancelled mid-read.
+        await asyncio.gather(*self.handlers)
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.handlers.add(task)
+        self.writers.add(writer)
+        room = name = None
+        try:
+            parts = (await reader.readline()).decode("utf-8").split()
+            if len(parts) != 3 or parts[0].upper() != "JOIN":
+                message = "Expected JOIN <room> <name>."
+                _send(writer, {"type": "error", "message": message})
+                return
+
+            _, room_name, name = parts
+            room = self.rooms.get(room_name)
+            if room is None:
+                try:
+                    room = await self._new_room(room_name)
+                except ValueError as e:
+                    _send(writer, {"type": "error", "message": str(e)})
+                    return
+
+            if name in room.players:
+                _send(writer, {"type": "error", "message": "That name is taken."})
+                room = None
+                return
+
+            room.join(name, writer)
+            while not room.finished:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                guess = line.decode("utf-8").strip().lower()
+                if guess == "!s":
+                    _send(writer, {"type": "scores", "scores": room.scores})
+                elif guess:
+                    _send(writer, room.guess(name, guess))
+                await writer.drain()
+        except (
+            ConnectionError, UnicodeDecodeError, ValueError, asyncio.LimitOverrunError
+        ):
+            # `readline` raises ValueError when a line is longer than the limit of the
+            # stream.
+            pass
+        finally:
+            if room is not None and not room.finished:
+                room.leave(name)
+            writer.close()
+            self.writers.discard(writer)
+            self.handlers.discard(task)
+
+    async def _new_room(self, name):
+        task = self.pending.get(name)
+        if task is None:
+            task = self.pending[name] = asyncio.ensure_future(self._create_room(name))
+            task.add_done_callback(lambda _: self.pending.pop(name, None))
+        # Shielded, so that one player giving up doesn't cancel it for the others.
+        return await asyncio.shield(task)
+
+    async def _create_room(self, name):
+        # Generating a board can take a while, so it's done in another thread to keep
+        # serving the other rooms meanwhile.
+        board, words = await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(
+                generate_board, self.trie, self.difficulty, size=self.size,
+                russian=self.russian, min_length=self.min_length, blanks=self.blanks,
+            ),
+        )
+        room = GameRoom(
+            name, board, words, duration=self.duration, min_length=self.min_length,
+            on_finish=lambda room: self.rooms.pop(room.name, None),
+        )
+        self.rooms[name] = room
+        return room
+
+
+class GameRoom:
+    """
+    A game on one board, shared by the players in a room of a `GameServer`.
+
+    The game ends when a timer runs out, not when a player next sends something, so
+    that every player is told the results at the same time.
+    """
+
+    def __init__(
+        self, name, board, words, *, duration, min_length=MIN_WORD_LENGTH,
+        on_finish=None,
+    ):
+        self.name = name
+        self.board = board
+        self.words = words
+        self.best_score = sum(map(score, words))
+        self.min_length = min_length
+        self.on_finish = on_finish
+        # Map from name to the player's connection, and to the words they have found.
+        self.players = {}
+        self.found = {}
+        self.scores = {}
+        self.finished = False
+
+        loop = asyncio.get_running_loop()
+        self.end = loop.time() + duration
+        self.timer = loop.call_later(duration, self.finish)
+
+    def join(self, name, writer):
+        self.players[name] = writer
+        self.found[name] = set()
+        self.scores[name] = 0
+        _send(writer, {
+            "type": "board",
+            "room": self.name,
+            "size": self.board.size,
+            "letters": self.board.letters,
+            "best_score": self.best_score,
+            "remaining": self.end - asyncio.get_running_loop().time(),
+        })
+
+    def leave(self, name):
+        del self.players[name]
+        del self.found[name]
+        del self.scores[name]
+        # Nobody is left to be told the results.
+        if not self.players:
+            self.timer.cancel()
+            self._close()
+
+    def guess(self, name, guess):
+        """Score the player's guess, and return the reply to send them."""
+        if guess in self.found[name]:
+            message = "You already said that."
+        else:
+            message = check_guess(
+                self.board, self.words, guess, min_length=self.min_length
+            )
+
+        if message is None:
+            self.found[name].add(guess)
+            self.scores[name] += score(guess)
+
+        return {
+            "type": "guess",
+            "word": guess,
+            "ok": message is None,
+            "message": message,
+            "score": self.scores[name],
+        }
+
+    def finish(self):
+        found = set().union(*self.found.values())
+        message = {
+            "type": "end",
+            "scores": self.scores,
+            "best_score": self.best_score,
+            "words": {name: sorted(words) for name, words in self.found.items()},
+            "missed": sorted(self.words - found),
+        }
+        for writer in self.players.values():
+            _send(writer, message)
+            writer.close()
+        self._close()
+
+    def _close(self):
+        self.finished = True
+        if self.on_finish is not None:
+            self.on_finish(self)
+
+
+def _send(writer, message):
+    writer.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+def parse_address(address):
+    """
+    Return (host, port, path) for `address`, where path is None for "HOST:PORT" and
+    host and port are None for the path of a Unix socket.
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and "/" not in address and port.isdigit():
+        return host or "localhost", int(port), None
+    else:
+        return None, None, address
+
+
+async def simulate(
+    address, trie, *, players, rooms, guesses, min_length=MIN_WORD_LENGTH,
+):
+    """
+    Connect `players` simulated players to the `GameServer` at `address`, spread
+    across `rooms` rooms, and have each of them make `guesses` guesses as fast as the
+    server answers. Return statistics on how quickly the server answered.
+
+    Half of the guesses are words on the board and half are random words from the
+    dictionary, most of which aren't on it.
+    """
+    host, port, path = parse_address(address)
+    room_names = [f"sim{os.getpid()}-{i}" for i in range(rooms)]
+    # The words of each room's board, found the first time a player sees the board.
+    board_words = {}
+    latencies = []
+
+    async def play(i):
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+
+        try:
+            room_name = room_names[i % rooms]
+            writer.write(f"JOIN {room_name} player{i}\n".encode("utf-8"))
+            message = json.loads(await reader.readline())
+            if message["type"] != "board":
+                raise ValueError(message.get("message", "could not join"))
+
+            if room_name not in board_words:
+                board = Board.from_list(message["letters"])
+                board_words[room_name] = sorted(
+                    board.all_words(trie, min_length=min_length)
+                )
+            words = board_words[room_name]
+
+            for _ in range(guesses):
+                if words and random.random() < 0.5:
+                    guess = random.choice(words)
+                else:
+                    guess = ""
+                    while not guess:
+                        guess = random.choice(trie.words)
+                start = time.perf_counter()
+                writer.write(guess.encode("utf-8") + b"\n")
+                line = await reader.readline()
+                if not line or json.loads(line)["type"] == "end":
+                    break
+                latencies.append(time.perf_counter() - start)
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(play(i) for i in range(players)))
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "players": players,
+        "rooms": rooms,
+        "guesses": len(latencies),
+        "seconds": seconds,
+        "guesses_per_second": len(latencies) / seconds,
+        "latency_ms": {
+            "median": _percentile(latencies, 50) * 1000,
+            "p99": _percentile(latencies, 99) * 1000,
+            "max": _percentile(latencies, 100) * 1000,
+        },
+    }
+
+
+def _percentile(values, percent):
+    """Return the `percent` percentile of the sorted list `values`, or 0 if empty."""
+    if not values:
+        return 0
+    index = math.ceil(len(values) * percent / 100) - 1
+    return values[max(index, 0)]
+
+
+class SolverStats:
+    """
+    Counts of the work done by `Board.all_words` and `Board.check`, and the time
+    spent in each phase of a run, for finding out where the time goes.
+
+    Pass one as the `stats` argument of those methods, and time other phases with
+    `phase`. The counts are summed over every call:
+
+      nodes      the number of search nodes visited (a tile on a path)
+      prunes     the number of paths abandoned because no word starts with them
+      lookups    the number of steps taken in the dictionary
+      max_depth  the length of the longest path searched, in letters (in tiles for
+                 `Board.check`)
+      words      the number of words found
+    """
+
+    COUNTS = ("nodes", "prunes", "lookups", "max_depth", "words")
+
+    def __init__(self):
+        self.nodes = 0
+        self.prunes = 0
+        self.lookups = 0
+        self.max_depth = 0
+        self.words = 0
+        # Map from the name of a phase to the number of seconds spent in it.
+        self.phases = collections.defaultdict(float)
+
+    def add(self, *, nodes=0, prunes=0, lookups=0, max_depth=0, words=0):
+        self.nodes += nodes
+        self.prunes += prunes
+        self.lookups += lookups
+        self.max_depth = max(self.max_depth, max_depth)
+        self.words += words
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Add the time spent in the `with` block to the phase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def as_dict(self):
+        """Return the statistics in a form that can be saved as JSON."""
+        d = {count: getattr(self, count) for count in self.COUNTS}
+        d["phases"] = dict(self.phases)
+        return d
+
+
 class Board:
     LETTERS = (
         (["a"] * 9) + (["b"] * 2)  + (["c"] * 2) + (["d"] * 4) + (["e"] * 12) +
@@ -156,96 +1786,468 @@ class Board:
         (["э"] * 1) + (["ю"] * 1) + (["я"] * 2)
     )
 
-    def __init__(self, *, size=BOARD_SIDE_LENGTH, russian=False):
+    def __init__(self, *, size=BOARD_SIDE_LENGTH, russian=False, blanks=0):
+        """
+        Make a random board of side `size`, with `blanks` of its tiles turned into
+        blanks (BLANK_TILE), which can stand for any tile.
+        """
         self.english = not russian
-        letter_set = self.LETTERS if self.english else self.LETTERS_RU
-        self.letters = random.sample(letter_set, size * size)
+        letters = random.sample(self.bag(size, russian=russian), size * size)
+        for i in random.sample(range(size * size), blanks):
+            letters[i] = BLANK_TILE
+        self.letters = letters
         self.size = size
 
     @classmethod
-    def from_list(cls, letters):
+    def bag(cls, size, *, russian=False):
+        """
+        Return the tiles that a board of side `size` is drawn from: the letter
+        distribution, repeated as many times as it takes to cover the board.
+        """
+        letter_set = cls.LETTERS_RU if russian else cls.LETTERS
+        copies = -(-(size * size) // len(letter_set))
+        return letter_set * copies
+
+    @property
+    def letters(self):
+        """
+        The tiles of the board, in row-major order.
+
+        Assign a new list to change all of them, which forgets the solution found by
+        `solve`, or use `replace` to change one; changing the list in place would leave
+        `positions` out of date.
+        """
+        return self._letters
+
+    @letters.setter
+    def letters(self, letters):
+        self._letters = letters
+        self._positions = None
+        self._codes = None
+        # The words found by `solve`, and the number of paths that spell each of them.
+        self._path_counts = None
+        self._paths = None
+        self.best_score = None
+
+    @property
+    def alphabet(self):
+        return ALPHABET_EN if self.english else ALPHABET_RU
+
+    @property
+    def codes(self):
+        """The codes in `alphabet` of the tiles of the board, as a bytearray."""
+        if self._codes is None:
+            self._codes = self.alphabet.encode(self._letters)
+        return self._codes
+
+    @property
+    def positions(self):
+        """A dictionary from each letter on the board to a sorted list of indices."""
+        if self._positions is None:
+            self._positions = {}
+            for i, letter in enumerate(self._letters):
+                self._positions.setdefault(letter, []).append(i)
+        return self._positions
+
+    @classmethod
+    def from_list(cls, letters, *, russian=False):
+        """
+        Construct a board from its tiles in row-major order. Any of them may be
+        BLANK_TILE.
+        """
         size = int(math.sqrt(len(letters)))
-        self = cls(size=size)
-        self.letters = letters
+        self = cls(size=size, russian=russian)
+        # Copied, since `replace` changes the list in place.
+        self.letters = list(letters)
         return self
 
-    def check(self, word):
-        if self.english and word.startswith("qu"):
-            first, rest = word[:2], word[2:]
+    @classmethod
+    def from_string(cls, text):
+        """
+        Construct a board from its tiles in row-major order, either separated by
+        whitespace or run together (in which case tiles of more than one letter, like
+        "qu", are recognized by `Alphabet.split`).
+        """
+        text = text.strip().lower()
+        alphabet = guess_alphabet(text.split())
+        if any(c.isspace() for c in text):
+            letters = text.split()
         else:
-            first, rest = word[0], word[1:]
+            letters = alphabet.split(text)
 
-        index = find(self.letters, first)
-        while index != -1:
-            if self._check_helper(rest, index, frozenset([index])):
-                return True
-            index = find(self.letters, first, index+1)
+        size = int(math.sqrt(len(letters)))
+        if size < 1 or size * size != len(letters):
+            raise ValueError(f"board {text!r} is not square")
 
-        return False
+        return cls.from_list(letters, russian=alphabet is ALPHABET_RU)
 
-    def _check_helper(self, word, last_index, already_used):
+    def check(self, word, *, stats=None):
         """
-        Return True if `word` can be spelled on the board started at `last_index` and
-        not using any of the indices in `already_used`.
+        Return True if `word` can be formed on the board. If `stats` is a `SolverStats`,
+        the work done is added to it.
         """
-        if not word:
-            return True
-
-        for index in self.adjacent(last_index):
-            if index in already_used:
+        if stats is None:
+            return self._check(word, None)
+        else:
+            with stats.phase("check"):
+                return self._check(word, stats)
+
+    def _check(self, word, stats):
+        tiles = self.alphabet.tokenize(word)
+        if not tiles:
+            return False
+
+        # Search depth-first with an explicit stack rather than recursion. An entry
+        # (index, n) means that the first `n` tiles of the word can be spelled by a path
+        # ending at `index`; an entry (~index, None) means that the search has gone
+        # back past `index`.
+        codes = self.codes
+        neighbors = self.neighbors
+        visited = set()
+        first = self.alphabet.tiles[tiles[0]]
+        starts = self.positions.get(first, [])
+        # A blank matches any tile.
+        blanks = self.positions.get(BLANK_TILE, [])
+        blank = Alphabet.BLANK
+        stack = [(index, 1) for index in starts + blanks]
+        nodes = prunes = max_depth = 0
+        found = False
+        while stack:
+            index, n = stack.pop()
+            if index < 0:
+                visited.remove(~index)
                 continue
 
-            letter = self.letters[index]
-            if word.startswith(letter):
-                result = self._check_helper(
-                    word[len(letter):], index, already_used | {index})
+            nodes += 1
+            if n > max_depth:
+                max_depth = n
+            if n == len(tiles):
+                found = True
+                break
+
+            visited.add(index)
+            stack.append((~index, None))
+            for adjacent_index in neighbors[index]:
+                if adjacent_index not in visited:
+                    code = codes[adjacent_index]
+                    if code == tiles[n] or code == blank:
+                        stack.append((adjacent_index, n + 1))
+                    else:
+                        prunes += 1
+
+        if stats is not None:
+            stats.add(
+                nodes=nodes, prunes=prunes, max_depth=max_depth, words=int(found)
+            )
+        return found
+
+    def all_words(
+        self, trie, *, min_length=MIN_WORD_LENGTH, max_length=None, stats=None,
+    ):
+        """
+        Return all words in `trie` that can be legally formed on the board and are at
+        least `min_length` and at most `max_length` characters in length.
+
+        `max_length` defaults to the length of the longest word in `trie`. Setting it
+        lower makes the search faster. If `stats` is a `SolverStats`, the work done is
+        added to it.
+        """
+        if stats is None:
+            return set(self._find_words(trie, min_length, max_length))
+
+        with stats.phase("solve"):
+            words = set(self._find_words(trie, min_length, max_length, stats))
+        stats.add(words=len(words))
+        return words
+
+    def iter_words(self, trie, *, min_length=MIN_WORD_LENGTH, max_length=None):
+        """
+        Yield the words that `all_words` returns, one at a time as they are found.
+
+        The search only goes as far as the words taken, so stopping early saves the
+        rest of it.
+        """
+        seen = set()
+        for word in self._find_words(trie, min_length, max_length):
+            if word not in seen:
+                seen.add(word)
+                yield word
+
+    def top_words(self, trie, k, *, by="score", min_length=MIN_WORD_LENGTH):
+        """
+        Return a list of the `k` best words on the board, best first, where the best
+        words are the highest-scoring ones if `by` is "score", or the longest ones if
+        it is "length".
+        """
+        if by == "score":
+            key = score
+        elif by == "length":
+            key = len
+        else:
+            raise ValueError(f"unknown order {by!r}")
 
-                if result:
-                    return True
+        words = self.iter_words(trie, min_length=min_length)
+        return heapq.nlargest(k, words, key=lambda word: (key(word), word))
 
+    def reaches_score(self, trie, target, *, min_length=MIN_WORD_LENGTH):
+        """
+        Return True if the words on the board are worth at least `target` points,
+        stopping the search as soon as they are.
+        """
+        if target <= 0:
+            return True
+
+        total = 0
+        for word in self.iter_words(trie, min_length=min_length):
+            total += score(word)
+            if total >= target:
+                return True
         return False
 
-    def all_words(self, dct, *, min_length=MIN_WORD_LENGTH):
+    def has_words(self, trie, *, min_length=MIN_WORD_LENGTH):
+        """Return True if there is any word on the board, stopping at the first one."""
+        return next(self.iter_words(trie, min_length=min_length), None) is not None
+
+    def _find_words(self, trie, min_length, max_length, stats=None):
         """
-        Return all words in the dictionary `dct` that can be legally formed on the
-        board and are at least `min_length` characters in length.
+        Yield the words that `all_words` returns, once for each path that spells them.
+
+        The search is depth-first, but it keeps its own stack instead of recursing, and
+        marks the tiles on the current path in a bytearray instead of a bitmask, so
+        that it scales to very large boards. An entry (node, index, length) on the
+        stack means that the path ending at `index` spells the `length` letters that
+        lead to `node` in `trie`; an entry (-1, index, None) means that the search has
+        gone back past `index`.
         """
-        words = set()
+        if max_length is None:
+            max_length = trie.max_length
+
+        codes = trie.alphabet.encode(self.letters)
+        lengths = trie.alphabet.lengths
+        neighbors = self.neighbors
+        child = trie.child
+        first = trie.first
+        targets = trie.targets
+        labels = trie.labels
+        word_ids = trie.word_ids
+        blank = Alphabet.BLANK
+        visited = bytearray(self.size * self.size)
+        stack = []
+        # Counting is cheap enough that it is always done, and only reported if asked.
+        nodes = prunes = lookups = max_depth = 0
         for i in range(self.size * self.size):
-            letter = self.letters[i]
-            words |= set(
-                self._all_words_helper(dct, letter, i, frozenset([i]), min_length)
-            )
-        return words
+            if codes[i] == blank:
+                for edge in range(first[Trie.ROOT], first[Trie.ROOT + 1]):
+                    if lengths[labels[edge]] <= max_length:
+                        stack.append((targets[edge], i, lengths[labels[edge]]))
+            else:
+                node = child(Trie.ROOT, codes[i])
+                lookups += 1
+                if node != -1 and lengths[codes[i]] <= max_length:
+                    stack.append((node, i, lengths[codes[i]]))
+
+            while stack:
+                node, index, length = stack.pop()
+                if node == -1:
+                    visited[index] = 0
+                    continue
 
+                nodes += 1
+                if length > max_depth:
+                    max_depth = length
+                if length >= min_length and word_ids[node] != -1:
+                    yield trie.words[word_ids[node]]
+
+                visited[index] = 1
+                stack.append((-1, index, None))
+                for adjacent_index in neighbors[index]:
+                    if visited[adjacent_index]:
+                        continue
+
+                    code = codes[adjacent_index]
+                    if length + lengths[code] > max_length:
+                        continue
+
+                    node2 = child(node, code)
+                    lookups += 1
+                    if node2 != -1:
+                        stack.append((node2, adjacent_index, length + lengths[code]))
+                    elif code == blank:
+                        # A blank continues the path along every edge out of `node`,
+                        # but no others, so the dictionary still prunes the search.
+                        for edge in range(first[node], first[node + 1]):
+                            n = length + lengths[labels[edge]]
+                            if n <= max_length:
+                                stack.append((targets[edge], adjacent_index, n))
+                    else:
+                        prunes += 1
+
+        if stats is not None:
+            stats.add(nodes=nodes, prunes=prunes, lookups=lookups, max_depth=max_depth)
+
+    def solve(self, trie, *, min_length=MIN_WORD_LENGTH):
+        """
+        Find all the words on the board like `all_words` does, but also remember enough
+        about how they were found that `replace` can update the solution incrementally.
 
-    def _all_words_helper(self, dct, word, last_index, already_used, min_length):
+        Afterwards, `words` is a set-like view of the words, and `best_score` is the
+        sum of their scores.
         """
-        Yield every word beginning with `word` that can be made starting at `last_index`
-        without using any indices in `already_used`, and that is at least `min_length`
-        characters in length.
+        self._trie = trie
+        self._trie_codes = trie.alphabet.encode(self.letters)
+        self._min_length = min_length
+        self._path_counts = collections.Counter()
+        self.best_score = 0
+        # `_paths[i]` holds a (node, already_used) pair for every path on the board that
+        # ends at `i` and spells a prefix of some word.
+        self._paths = [[] for _ in range(self.size * self.size)]
+        for i in range(self.size * self.size):
+            for node in trie.children(Trie.ROOT, self._trie_codes[i]):
+                self._extend_paths(node, i, 1 << i)
+        return self.words
+
+    @property
+    def words(self):
+        """The words found by `solve`, kept up to date by `replace`."""
+        if self._path_counts is None:
+            raise ValueError("board has not been solved")
+        return self._path_counts.keys()
+
+    def replace(self, index, letter):
         """
-        dct_index = bisect.bisect_left(dct, word)
-        if dct_index == len(dct):
-            return
+        Replace the tile at `index` with `letter`.
 
-        if dct[dct_index] == word and len(word) >= min_length:
-            yield word
+        If the board has been solved with `solve`, then `words` and `best_score` are
+        updated by forgetting the paths that went through `index` and searching for
+        new ones, which is much faster than solving the whole board again.
+        """
+        if self._positions is not None:
+            self._positions[self._letters[index]].remove(index)
+            bisect.insort(self._positions.setdefault(letter, []), index)
 
-        if not dct[dct_index].startswith(word):
-            # No word in the dictionay starts with this sequence, so we can prematurely
-            # terminate.
+        if self._codes is not None:
+            self._codes[index] = self.alphabet.code(letter)
+
+        if self._path_counts is None:
+            self._letters[index] = letter
             return
 
-        for adjacent_index in self.adjacent(last_index):
-            if adjacent_index in already_used:
+        trie = self._trie
+        bit = 1 << index
+        for paths in self._paths:
+            removed = [node for node, already_used in paths if already_used & bit]
+            if removed:
+                paths[:] = [path for path in paths if not path[1] & bit]
+                for node in removed:
+                    word = trie.word(node)
+                    if word is not None and len(word) >= self._min_length:
+                        self._path_counts[word] -= 1
+                        if self._path_counts[word] == 0:
+                            del self._path_counts[word]
+                            self.best_score -= score(word)
+
+        self._letters[index] = letter
+        code = self._trie_codes[index] = trie.alphabet.code(letter)
+        # Every new path through `index` either starts there or continues a path that
+        # ends next to it, so collect the latter before adding any new paths.
+        prefixes = [
+            path for adjacent_index in self.neighbors[index]
+            for path in self._paths[adjacent_index]
+        ]
+        for node in trie.children(Trie.ROOT, code):
+            self._extend_paths(node, index, bit)
+
+        for node, already_used in prefixes:
+            for child in trie.children(node, code):
+                self._extend_paths(child, index, already_used | bit)
+
+    def _extend_paths(self, node, last_index, already_used):
+        """
+        Record the path that ends at `last_index` with the trie node `node`, and all of
+        its continuations, in `_paths` and `_path_counts`.
+        """
+        self._paths[last_index].append((node, already_used))
+        trie = self._trie
+        word = trie.word(node)
+        if word is not None and len(word) >= self._min_length:
+            if word not in self._path_counts:
+                self.best_score += score(word)
+            self._path_counts[word] += 1
+
+        codes = self._trie_codes
+        for adjacent_index in self.neighbors[last_index]:
+            if already_used & (1 << adjacent_index):
                 continue
 
-            word2 = word + self.letters[adjacent_index]
-            already_used2 = already_used | {adjacent_index}
-            yield from self._all_words_helper(
-                dct, word2, adjacent_index, already_used2, min_length,
+            code = codes[adjacent_index]
+            if code != Alphabet.BLANK:
+                child = trie.child(node, code)
+                if child != -1:
+                    self._extend_paths(
+                        child, adjacent_index, already_used | (1 << adjacent_index)
+                    )
+            else:
+                for child in trie.children(node, code):
+                    self._extend_paths(
+                        child, adjacent_index, already_used | (1 << adjacent_index)
+                    )
+
+    # Maps a board size to its table of adjacent indices (see `neighbors`).
+    _NEIGHBORS = {}
+
+    @property
+    def neighbors(self):
+        """
+        A tuple whose `i`th element is a tuple of the indices adjacent to `i`.
+
+        Unlike `adjacent`, this doesn't recompute anything: the table is built once
+        for each board size and shared by all boards of that size.
+        """
+        table = self._NEIGHBORS.get(self.size)
+        if table is None:
+            table = tuple(
+                tuple(self.adjacent(i)) for i in range(self.size * self.size)
             )
+            self._NEIGHBORS[self.size] = table
+        return table
+
+    # Maps a board size to its symmetries (see `canonical`).
+    _SYMMETRIES = {}
+
+    def canonical(self):
+        """
+        Return the letters of the board, as a tuple, turned and flipped to whichever of
+        its 8 rotations and reflections comes first in order.
+
+        All these boards have the same words, so boards with the same canonical letters
+        only need to be solved once.
+        """
+        symmetries = self._SYMMETRIES.get(self.size)
+        if symmetries is None:
+            n = self.size
+            cells = [(row, column) for row in range(n) for column in range(n)]
+            transforms = [
+                lambda r, c: (r, c),
+                lambda r, c: (c, n - 1 - r),
+                lambda r, c: (n - 1 - r, n - 1 - c),
+                lambda r, c: (n - 1 - c, r),
+            ]
+            symmetries = []
+            for transform in transforms:
+                for flip in (False, True):
+                    # The `i`th letter of the transformed board is the one at
+                    # `indices[i]` on this board.
+                    indices = [None] * (n * n)
+                    for i, (row, column) in enumerate(cells):
+                        r, c = transform(row, column)
+                        if flip:
+                            c = n - 1 - c
+                        indices[r * n + c] = i
+                    symmetries.append(tuple(indices))
+            self._SYMMETRIES[self.size] = symmetries
+
+        letters = self.letters
+        return min(tuple(letters[i] for i in indices) for indices in symmetries)
 
     def adjacent(self, index):
         """Yield the indices adjacent to `index` on the board."""
@@ -298,6 +2300,308 @@ class Board:
         print()
 
 
+class Alphabet:
+    """
+    The tiles of a language, numbered so that boards and words can be handled as
+    sequences of small integers (codes). A tile of more than one letter, like "qu", is
+    a single symbol like any other.
+    """
+
+    # The code of anything that is not a tile of the alphabet.
+    UNKNOWN = 255
+    # The code of a blank tile (BLANK_TILE on a board), which stands for any tile.
+    BLANK = 254
+
+    def __init__(self, tiles):
+        self.tiles = tuple(sorted(set(tiles)))
+        if len(self.tiles) >= self.BLANK:
+            raise ValueError("too many tiles for an alphabet")
+
+        self.codes = {tile: code for code, tile in enumerate(self.tiles)}
+        # Blanks can be on a board, but not in a word.
+        self._board_codes = dict(self.codes)
+        self._board_codes[BLANK_TILE] = self.BLANK
+        # The number of letters in the tile with each code. An unknown tile counts as
+        # one letter.
+        self.lengths = bytes(
+            len(self.tiles[code]) if code < len(self.tiles) else 1
+            for code in range(256)
+        )
+        # Try longer tiles first, so that e.g. "qu" is matched instead of "q".
+        self.pattern = re.compile(
+            "|".join(map(re.escape, sorted(self.tiles, key=len, reverse=True))) + "|.",
+            re.DOTALL,
+        )
+
+    def code(self, tile):
+        """
+        Return the code of `tile`, BLANK if it is a blank, or UNKNOWN if it is not in
+        the alphabet.
+        """
+        return self._board_codes.get(tile, self.UNKNOWN)
+
+    def encode(self, tiles):
+        """Return the codes (see `code`) of the sequence of `tiles` as a bytearray."""
+        codes = self._board_codes
+        return bytearray(codes.get(tile, self.UNKNOWN) for tile in tiles)
+
+    def split(self, text):
+        """
+        Split `text` into tiles, taking the longest tile that matches at each point.
+        A character that doesn't start any tile becomes a tile of its own.
+        """
+        return self.pattern.findall(text)
+
+    def tokenize(self, word):
+        """
+        Return the codes of the tiles of `word` (see `split`) as bytes, or None if
+        `word` can't be spelled with the alphabet (e.g., an English word with a "q"
+        that isn't followed by a "u").
+        """
+        try:
+            return bytes(map(self.codes.__getitem__, self.pattern.findall(word)))
+        except KeyError:
+            return None
+
+    def __eq__(self, other):
+        return isinstance(other, Alphabet) and self.tiles == other.tiles
+
+    def __hash__(self):
+        return hash(self.tiles)
+
+
+ALPHABET_EN = Alphabet(Board.LETTERS)
+ALPHABET_RU = Alphabet(Board.LETTERS_RU)
+# Every alphabet that `guess_alphabet` knows about.
+ALPHABETS = (ALPHABET_EN, ALPHABET_RU)
+
+
+def guess_alphabet(words):
+    """
+    Return the alphabet in ALPHABETS that can spell the most of the first `words`.
+    Blank tiles are ignored, since every alphabet has them.
+    """
+    sample = [word.replace(BLANK_TILE, "") for word in itertools.islice(words, 100)]
+    sample = [word for word in sample if word]
+
+    def spellable(alphabet):
+        return sum(alphabet.tokenize(word) is not None for word in sample)
+
+    return max(ALPHABETS, key=spellable)
+
+
+class Trie:
+    """
+    A prefix tree over the words of a dictionary, so that the solver can advance one
+    node per tile and give up as soon as no word starts with the letters so far.
+
+    The edges of the tree are labelled with the codes of tiles in `alphabet` rather
+    than with characters, so that the solver walks one edge per tile even for tiles
+    like "qu". Words that can't be spelled with the alphabet are left out.
+
+    Nodes are integers, and the tree is stored in a few flat arrays instead of as one
+    object per node. The edges out of node `n` are numbered `first[n]` up to (but not
+    including) `first[n+1]`; edge `e` is labelled with the code `labels[e]` and leads
+    to node `targets[e]`. `word_ids[n]` is the index in `words` of the word that ends
+    at `n`, or -1 if no word does.
+    """
+
+    ROOT = 0
+
+    # Layout of the header of a compiled dictionary: a magic string followed by the
+    # number of nodes, edges and words, the length of the longest word, and the size in
+    # bytes of the alphabet's tiles and of the words. The arrays, the labels and then
+    # the encoded strings follow the header, in the order they are written by `save`,
+    # in native byte order.
+    HEADER = struct.Struct("=8sIIIIII")
+    MAGIC = b"BOGTRIE2"
+
+    def __init__(self, words, alphabet=None):
+        if alphabet is None:
+            alphabet = guess_alphabet(words)
+
+        # Build the tree out of nested dictionaries first, and then flatten it
+        # breadth-first so that the children of each node are contiguous.
+        root = {}
+        self.max_length = 0
+        for i, word in enumerate(words):
+            codes = alphabet.tokenize(word)
+            if not codes:
+                continue
+
+            node = root
+            for code in codes:
+                node = node.setdefault(code, {})
+            # No code is None, so it is safe to use as a marker.
+            node[None] = i
+            self.max_length = max(self.max_length, len(word))
+
+        self.alphabet = alphabet
+        self.words = words
+        self.first = array.array("I")
+        self.targets = array.array("I")
+        self.word_ids = array.array("i")
+        labels = bytearray()
+        queue = [root]
+        # `queue` grows as we iterate over it, which is fine for a list.
+        for node in queue:
+            self.first.append(len(labels))
+            self.word_ids.append(node.pop(None, -1))
+            for code in sorted(node):
+                labels.append(code)
+                self.targets.append(len(queue))
+                queue.append(node[code])
+        self.first.append(len(labels))
+        self.labels = bytes(labels)
+        self._transitions = None
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a trie saved with `save` by memory-mapping the file at `path`.
+
+        Nothing is parsed or copied except the edge labels, so loading is fast, and
+        all the processes that load the same file share a single read-only copy of it.
+        """
+        with open(path, "rb") as f:
+            buf = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+        header = cls.HEADER.unpack_from(buf)
+        magic, nodes, edges, words, max_length, tiles_size, blob_size = header
+        if magic != cls.MAGIC:
+            raise ValueError(f"{path} is not a compiled dictionary")
+
+        offset = cls.HEADER.size
+        def take(n, fmt):
+            nonlocal offset
+            size = n * struct.calcsize(fmt)
+            offset += size
+            return buf[offset-size:offset].cast(fmt)
+
+        self = cls.__new__(cls)
+        self.first = take(nodes + 1, "I")
+        self.targets = take(edges, "I")
+        self.word_ids = take(nodes, "i")
+        word_offsets = take(words + 1, "I")
+        self.labels = bytes(take(edges, "B"))
+        self.alphabet = Alphabet(str(take(tiles_size, "B"), "utf-8").split("\n"))
+        self.words = WordTable(word_offsets, take(blob_size, "B"))
+        self.max_length = max_length
+        self._transitions = None
+        return self
+
+    def save(self, path):
+        """Save the trie to `path` in the format read by `load`."""
+        word_offsets = array.array("I", [0])
+        blob = bytearray()
+        for word in self.words:
+            blob += word.encode("utf-8")
+            word_offsets.append(len(blob))
+        tiles = "\n".join(self.alphabet.tiles).encode("utf-8")
+
+        with open(path, "wb") as f:
+            f.write(self.HEADER.pack(
+                self.MAGIC, len(self), len(self.targets), len(self.words),
+                self.max_length, len(tiles), len(blob),
+            ))
+            f.write(array.array("I", self.first).tobytes())
+            f.write(array.array("I", self.targets).tobytes())
+            f.write(array.array("i", self.word_ids).tobytes())
+            f.write(word_offsets.tobytes())
+            f.write(self.labels)
+            f.write(tiles)
+            f.write(blob)
+
+    def child(self, node, code):
+        """
+        Return the node reached by following the edge labelled `code` from `node`, or
+        -1 if there is no such edge.
+        """
+        edge = self.labels.find(code, self.first[node], self.first[node+1])
+        return self.targets[edge] if edge != -1 else -1
+
+    def children(self, node, code):
+        """
+        Return the nodes reached from `node` by a tile with code `code`: every child
+        of `node` if `code` is Alphabet.BLANK, or else `child(node, code)` if it
+        exists.
+        """
+        if code == Alphabet.BLANK:
+            return self.targets[self.first[node]:self.first[node+1]]
+
+        child = self.child(node, code)
+        return (child,) if child != -1 else ()
+
+    def transitions(self):
+        """
+        Return a NumPy array whose element [n, c] is `child(n, c)`, with an extra
+        column of -1 for codes that aren't in the alphabet. This requires NumPy.
+
+        The table is built the first time it is needed, and kept.
+        """
+        if self._transitions is None:
+            first = np.frombuffer(self.first, dtype=np.uint32).astype(np.intp)
+            sources = np.repeat(np.arange(len(self)), np.diff(first))
+            labels = np.frombuffer(self.labels, dtype=np.uint8)
+            table = np.full((len(self), len(self.alphabet.tiles) + 1), -1, np.int32)
+            table[sources, labels] = np.frombuffer(self.targets, dtype=np.uint32)
+            self._transitions = table
+        return self._transitions
+
+    def lookup(self, word):
+        """Return the node reached by spelling `word` from the root, or -1."""
+        codes = self.alphabet.tokenize(word)
+        if codes is None:
+            return -1
+
+        node = self.ROOT
+        for code in codes:
+            node = self.child(node, code)
+            if node == -1:
+                break
+        return node
+
+    def word(self, node):
+        """Return the word that ends at `node`, or None if no word does."""
+        word_id = self.word_ids[node]
+        return self.words[word_id] if word_id != -1 else None
+
+    def __contains__(self, word):
+        node = self.lookup(word)
+        return node != -1 and self.word_ids[node] != -1
+
+    def __len__(self):
+        """Return the number of nodes in the tree."""
+        return len(self.word_ids)
+
+
+class WordTable(collections.abc.Sequence):
+    """
+    A read-only sorted list of words, stored back to back as UTF-8 in a buffer and
+    decoded one at a time on access.
+
+    The words of a compiled dictionary are kept this way so that loading it does not
+    allocate a string per word.
+    """
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("word index out of range")
+        return str(self.blob[self.offsets[index]:self.offsets[index+1]], "utf-8")
+
+    def __contains__(self, word):
+        return check_dictionary(self, word)
+
+
 def score(word):
     if len(word) == 3 or len(word) == 4:
         return 1
@@ -313,26 +2617,74 @@ def score(word):
         return 0
 
 
+def check_guess(board, words, guess, *, min_length=MIN_WORD_LENGTH, trie=None):
+    """
+    Return None if `guess` is one of `words`, the words of `board`, or else a message
+    saying what is wrong with it.
+
+    If the board hasn't been solved yet, `words` may be None, in which case `guess`
+    is looked up in `trie` and on the board instead.
+    """
+    if len(guess) < min_length:
+        return f"Too short. (minimum length: {min_length})"
+
+    if words is None:
+        if not board.check(guess):
+            return "Not on the board."
+        elif guess not in trie:
+            return "Not in dictionary."
+        else:
+            return None
+
+    # Every valid word has already been found, so only invalid words need to be
+    # checked, to tell the player what is wrong with them.
+    if guess not in words:
+        if not board.check(guess):
+            return "Not on the board."
+        else:
+            return "Not in dictionary."
+
+    return None
+
+
 def check_dictionary(dct, word):
     """Return True if `word` is in `dct`."""
     index = bisect.bisect_left(dct, word)
     return index < len(dct) and dct[index] == word
 
 
-def find(lst, item, start=0):
+def open_dictionary(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().split("\n")
+
+
+def compile_dictionary(path, output):
     """
-    Return the first index greater than or equal to `start` of `item` in `lst`, or -1
-    if no element of `lst` is equal to `item`.
+    Compile the text dictionary at `path` into a file at `output` that `load_trie` can
+    memory-map instead of parsing.
     """
-    for i, x in enumerate(lst):
-        if x == item and i >= start:
-            return i
-    return -1
+    words = [word for word in open_dictionary(path) if word]
+    Trie(words).save(output)
 
 
-def open_dictionary(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read().split("\n")
+def load_trie(path):
+    """
+    Return a Trie of the words in the dictionary at `path`.
+
+    If `path` is a text file and there is an up-to-date compiled copy of it next to it
+    (e.g., `en.trie` for `en.txt`), the compiled copy is loaded instead.
+    """
+    base, extension = os.path.splitext(path)
+    if extension != COMPILED_EXTENSION:
+        compiled = base + COMPILED_EXTENSION
+        if (
+            not os.path.exists(compiled)
+            or os.path.getmtime(compiled) < os.path.getmtime(path)
+        ):
+            return Trie(open_dictionary(path))
+        path = compiled
+
+    return Trie.load(path)
 
 
 def now():
@@ -347,12 +2699,117 @@ def time_add(t, secs):
     return t + secs
 
 
+# Settings of `run_benchmarks`. Don't change them without good reason, or the results
+# will no longer be comparable with earlier ones.
+BENCHMARK_SEED = 1930
+BENCHMARK_SIZES = range(3, 11)
+BENCHMARK_DICTIONARIES = (DICTIONARY_EN, DICTIONARY_EN_FULL)
+BENCHMARK_BOARDS_PER_SIZE = 5
+BENCHMARK_REPEAT = 3
+# The boards from `BoggleTest`.
+BENCHMARK_REGRESSION_BOARDS = (
+    "ezoaltarnelktsib", "uneneeqsrynhopkr", "lnigokquiienhbnus",
+)
+
+
+def run_benchmarks(
+    *, dictionaries=BENCHMARK_DICTIONARIES, sizes=BENCHMARK_SIZES,
+    boards_per_size=BENCHMARK_BOARDS_PER_SIZE, repeat=BENCHMARK_REPEAT,
+):
+    """
+    Time loading the dictionaries, generating boards, and solving and checking boards
+    of each size in `sizes` plus the regression boards, and return the results in a
+    form that can be saved as JSON and compared with other runs.
+
+    Boards are generated from fixed seeds, so every run measures the same boards.
+    Times are the best of `repeat` runs, and peak memory is measured in a separate
+    run, since tracing allocations slows everything down.
+    """
+    results = []
+
+    def record(benchmark, dictionary, f, **extra):
+        seconds = min(_time(f) for _ in range(repeat))
+        tracemalloc.start()
+        try:
+            f()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        result = dict(
+            benchmark=benchmark, dictionary=os.path.basename(dictionary),
+            seconds=seconds, peak_bytes=peak,
+        )
+        result.update(extra)
+        results.append(result)
+
+    for dictionary in dictionaries:
+        record("open_dictionary", dictionary, lambda: open_dictionary(dictionary))
+        words = open_dictionary(dictionary)
+        record("trie", dictionary, lambda: Trie(words))
+        trie = Trie(words)
+
+        board_sets = [
+            ("regression", [Board.from_string(b) for b in BENCHMARK_REGRESSION_BOARDS])
+        ]
+        for size in sizes:
+            random.seed(BENCHMARK_SEED + size)
+            boards = [Board(size=size) for _ in range(boards_per_size)]
+            board_sets.append((size, boards))
+
+            def generate():
+                random.seed(BENCHMARK_SEED + size)
+                for _ in range(boards_per_size):
+                    generate_board(trie, size=size)
+
+            record("generate_board", dictionary, generate, size=size)
+
+        for size, boards in board_sets:
+            stats = SolverStats()
+            solutions = [board.all_words(trie, stats=stats) for board in boards]
+            record(
+                "all_words", dictionary,
+                lambda: [board.all_words(trie) for board in boards],
+                size=size, boards=len(boards), nodes=stats.nodes,
+                words=sum(map(len, solutions)),
+            )
+
+            # Check every word on each board, and as many words from the dictionary
+            # that aren't.
+            checks = []
+            for board, solution in zip(boards, solutions):
+                misses = itertools.islice(
+                    (word for word in words if word and word not in solution),
+                    len(solution),
+                )
+                checks.extend((board, word) for word in solution)
+                checks.extend((board, word) for word in misses)
+            record(
+                "check", dictionary,
+                lambda: [board.check(word) for board, word in checks],
+                size=size, boards=len(boards), checks=len(checks),
+            )
+
+    return {
+        "python": platform.python_version(),
+        "seed": BENCHMARK_SEED,
+        "results": results,
+    }
+
+
+def _time(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
 class BoggleTest(unittest.TestCase):
     """Run with `./boggle --test`."""
 
     @classmethod
     def setUpClass(cls):
         cls.dct = open_dictionary(DICTIONARY_EN)
+        cls.trie = Trie(cls.dct)
 
     def test_adjacent(self):
         #  0   1   2   3
@@ -367,6 +2824,16 @@ class BoggleTest(unittest.TestCase):
         self.assertEqual(set(board.adjacent(12)), {8, 9, 13})
         self.assertEqual(set(board.adjacent(15)), {10, 11, 14})
 
+        for i in range(16):
+            self.assertEqual(set(board.neighbors[i]), set(board.adjacent(i)))
+        self.assertIs(Board(size=4).neighbors, board.neighbors)
+
+    def test_bag(self):
+        self.assertEqual(Board.bag(4), Board.LETTERS)
+        self.assertEqual(Board.bag(9, russian=True), Board.LETTERS_RU * 1)
+        self.assertEqual(Board.bag(10), Board.LETTERS * 2)
+        self.assertEqual(len(Board(size=20).letters), 400)
+
     def test_check_board(self):
         # E Z O A
         # L T A R
@@ -383,6 +2850,23 @@ class BoggleTest(unittest.TestCase):
         # Cannot use the same 'T' twice.
         self.assertFalse(board.check("TAT"))
 
+    def test_positions(self):
+        board = Board.from_list(list("abacabcbd"))
+        self.assertEqual(board.positions, {
+            "a": [0, 2, 4], "b": [1, 5, 7], "c": [3, 6], "d": [8],
+        })
+
+        board.replace(8, "a")
+        board.replace(0, "e")
+        self.assertEqual(board.positions, {
+            "a": [2, 4, 8], "b": [1, 5, 7], "c": [3, 6], "d": [], "e": [0],
+        })
+        self.assertTrue(board.check("bae"))
+        self.assertFalse(board.check("dab"))
+
+        board.letters = list("xxxxxxxxx")
+        self.assertEqual(board.positions, {"x": list(range(9))})
+
     def test_check_dictionary(self):
         self.assertTrue(check_dictionary(self.dct, "mat"))
         self.assertFalse(check_dictionary(self.dct, "jkldfalkb"))
@@ -409,10 +2893,644 @@ class BoggleTest(unittest.TestCase):
         # I  E  N  H
         # B  N  U  S
         board = Board.from_list(list("lnigok") + ["qu"] + list("iienhbnus"))
-        words = board.all_words(self.dct)
+        words = board.all_words(self.trie)
         self.assertIn("unique", words)
         self.assertNotIn("bib", words)
 
+    def test_trie(self):
+        trie = Trie(["", "cat", "cats", "dog"])
+        self.assertIn("cat", trie)
+        self.assertIn("cats", trie)
+        self.assertNotIn("ca", trie)
+        self.assertNotIn("", trie)
+        self.assertNotIn("cow", trie)
+        self.assertEqual(trie.word(trie.lookup("dog")), "dog")
+        self.assertIsNone(trie.word(trie.lookup("do")))
+        self.assertEqual(trie.lookup("cd"), -1)
+        self.assertEqual(
+            trie.child(trie.lookup("ca"), trie.alphabet.code("t")), trie.lookup("cat")
+        )
+
+        trie = Trie(["quit", "qat", "quq"], ALPHABET_EN)
+        self.assertIn("quit", trie)
+        self.assertNotIn("qat", trie)
+        self.assertNotIn("quq", trie)
+        self.assertEqual(trie.child(Trie.ROOT, ALPHABET_EN.code("q")), -1)
+        self.assertEqual(trie.max_length, 4)
+
+    def test_alphabet(self):
+        self.assertEqual(len(ALPHABET_EN.tiles), 26)
+        qu = ALPHABET_EN.code("qu")
+        self.assertEqual(ALPHABET_EN.lengths[qu], 2)
+        self.assertEqual(
+            ALPHABET_EN.tokenize("queen"), bytes(ALPHABET_EN.encode("qu e e n".split()))
+        )
+        self.assertIsNone(ALPHABET_EN.tokenize("qat"))
+        self.assertIsNone(ALPHABET_EN.tokenize("ёж"))
+        self.assertEqual(ALPHABET_EN.split("quqz"), ["qu", "q", "z"])
+        self.assertEqual(ALPHABET_EN.code("ё"), Alphabet.UNKNOWN)
+        self.assertEqual(guess_alphabet(["ёж", "дом"]), ALPHABET_RU)
+        self.assertEqual(guess_alphabet(["cat", "dog"]), ALPHABET_EN)
+
+        alphabet = Alphabet(["a", "b", "ch", "c"])
+        self.assertEqual(
+            [alphabet.tiles[code] for code in alphabet.tokenize("chcab")],
+            ["ch", "c", "a", "b"],
+        )
+
+    def test_compiled_dictionary(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "words.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("cat\ncats\ndog\nquit\n")
+
+            compiled = os.path.join(d, "words" + COMPILED_EXTENSION)
+            compile_dictionary(path, compiled)
+            trie = load_trie(path)
+            self.assertIsInstance(trie.words, WordTable)
+            self.assertEqual(list(trie.words), ["cat", "cats", "dog", "quit"])
+            self.assertEqual(trie.alphabet, ALPHABET_EN)
+            self.assertEqual(trie.max_length, 4)
+            self.assertIn("quit", trie)
+            self.assertIn("cats", trie)
+            self.assertNotIn("ca", trie)
+            self.assertTrue(check_dictionary(trie.words, "dog"))
+            self.assertFalse(check_dictionary(trie.words, "do"))
+
+            path = os.path.join(d, "ru.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("дом\nёж\n")
+            compile_dictionary(path, compiled)
+            trie = Trie.load(compiled)
+            self.assertEqual(trie.alphabet, ALPHABET_RU)
+            self.assertIn("ёж", trie)
+            board = Board.from_list(list("ёжздомабв"), russian=True)
+            self.assertEqual(board.all_words(trie, min_length=2), {"дом", "ёж"})
+
+        trie = Trie([word for word in self.dct if word])
+        board = Board.from_list(list("lnigok") + ["qu"] + list("iienhbnus"))
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "en" + COMPILED_EXTENSION)
+            trie.save(path)
+            self.assertEqual(
+                board.all_words(Trie.load(path)), board.all_words(self.trie)
+            )
+
+    def test_from_string(self):
+        board = Board.from_string("LNIGOKQUIIENHBNUS\n")
+        self.assertEqual(board.letters, list("lnigok") + ["qu"] + list("iienhbnus"))
+        self.assertEqual(board.size, 4)
+
+        board = Board.from_string("a b c d e f g h qu")
+        self.assertEqual(board.letters, list("abcdefgh") + ["qu"])
+        self.assertEqual(board.size, 3)
+
+        board = Board.from_string("домикспат")
+        self.assertFalse(board.english)
+
+        board = Board.from_string("дом?кспат")
+        self.assertFalse(board.english)
+        self.assertEqual(board.letters[3], BLANK_TILE)
+        self.assertTrue(board.check("дома"))
+
+        with self.assertRaises(ValueError):
+            Board.from_string("abcde")
+
+    def test_solve_batch(self):
+        boards = [
+            Board.from_string("lnigokquiienhbnus"),
+            Board.from_string("ezoaltarnelktsib"),
+            Board.from_string("xxxxxxxxx"),
+        ]
+        # The same board turned upside down.
+        boards.append(Board.from_list(boards[1].letters[::-1]))
+        output = io.StringIO()
+        solve_batch(iter(boards), DICTIONARY_EN, output, jobs=2)
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+
+        self.assertEqual(len(results), len(boards))
+        for board, result in zip(boards, results):
+            words = board.all_words(self.trie)
+            self.assertEqual(result["board"], "".join(board.letters))
+            self.assertEqual(result["words"], sorted(words))
+            self.assertEqual(result["score"], sum(map(score, words)))
+        self.assertEqual(results[2]["score"], 0)
+
+        # Lines that aren't boards are skipped with a warning.
+        stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            boards = list(read_boards(["abcdefghi\n", "abc\n", "\n", "xxxxxxxxx\n"]))
+            warnings = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(
+            [board.letters for board in boards], [list("abcdefghi"), ["x"] * 9]
+        )
+        self.assertIn("line 2", warnings)
+
+    def test_difficulty(self):
+        difficulty = Difficulty(min_score=3, max_score=5, min_long_words=1)
+        self.assertEqual(difficulty.distance({"cat", "dog", "horse"}), 3)
+        self.assertEqual(difficulty.distance({"horses"}), 0)
+        self.assertEqual(difficulty.distance({"horses", "kitten", "cat"}), 2)
+        self.assertEqual(Difficulty().distance(set()), 1)
+        self.assertEqual(Difficulty().distance({"cat"}), 0)
+
+    def test_generate_board(self):
+        random.seed(5)
+        difficulty = Difficulty(min_score=80, min_long_words=3)
+        board, words = generate_board(self.trie, difficulty)
+        self.assertEqual(words, board.all_words(self.trie))
+        self.assertEqual(difficulty.distance(words), 0)
+        self.assertEqual(
+            collections.Counter(board.letters) - collections.Counter(Board.LETTERS),
+            collections.Counter(),
+        )
+
+        with self.assertRaises(ValueError):
+            generate_board(self.trie, Difficulty(max_score=-1), size=3)
+
+        # Easy boards keep their blanks, even though they have more words without them.
+        for _ in range(3):
+            board, words = generate_board(
+                self.trie, Difficulty(1, 15, 0), size=3, blanks=2
+            )
+            self.assertEqual(board.letters.count(BLANK_TILE), 2)
+            self.assertEqual(Difficulty(1, 15, 0).distance(words), 0)
+
+    def test_board_pool(self):
+        random.seed(6)
+        with tempfile.TemporaryDirectory() as d:
+            difficulty = Difficulty(min_score=20)
+            pool = BoardPool(d, DICTIONARY_EN, self.trie, difficulty)
+            pool.refill()
+            self.assertEqual(len(pool), POOL_SIZE)
+
+            board, words = pool.take()
+            self.assertEqual(len(pool), POOL_SIZE - 1)
+            self.assertEqual(words, board.all_words(self.trie))
+            self.assertEqual(difficulty.distance(words), 0)
+
+            # A pool with different settings doesn't share the boards.
+            other = BoardPool(d, DICTIONARY_EN, self.trie, difficulty, size=5)
+            self.assertEqual(len(other), 0)
+
+            # Nor do different dictionaries of the same name, or versions of the same
+            # dictionary.
+            dictionary = os.path.join(d, "words", os.path.basename(DICTIONARY_EN))
+            os.makedirs(os.path.dirname(dictionary))
+            shutil.copyfile(DICTIONARY_EN, dictionary)
+            other = BoardPool(d, dictionary, self.trie, difficulty)
+            self.assertEqual(len(other), 0)
+            other.refill()
+            other = BoardPool(d, dictionary, self.trie, difficulty)
+            self.assertEqual(len(other), POOL_SIZE)
+            with open(dictionary, "a", encoding="utf-8") as f:
+                f.write("zzz\n")
+            other = BoardPool(d, dictionary, self.trie, difficulty)
+            self.assertEqual(len(other), 0)
+
+            # Boards taken from a Russian pool are still Russian.
+            words = ["дно", "дом"]
+            dictionary = os.path.join(d, "ru.txt")
+            with open(dictionary, "w", encoding="utf-8") as f:
+                f.write("\n".join(words) + "\n")
+            trie = Trie(words, ALPHABET_RU)
+            pool = BoardPool(
+                d, dictionary, trie, Difficulty(min_score=0), size=3, russian=True,
+            )
+            pool.refill()
+            board, _ = pool.take()
+            self.assertFalse(board.english)
+            self.assertTrue(board.check("".join(board.letters[:3])))
+
+    def test_replace(self):
+        random.seed(8)
+        for size in (3, 4, 5):
+            board = Board(size=size)
+            board.solve(self.trie)
+            for _ in range(20):
+                index = random.randrange(size * size)
+                board.replace(index, random.choice(Board.LETTERS))
+                expected = board.all_words(self.trie)
+                self.assertEqual(set(board.words), expected)
+                self.assertEqual(board.best_score, sum(map(score, expected)))
+
+        # Assigning new letters forgets the solution.
+        board.letters = ["x"] * (size * size)
+        self.assertIsNone(board.best_score)
+        with self.assertRaises(ValueError):
+            board.words
+
+        letters = list("abcdefghi")
+        Board.from_list(letters).replace(0, "z")
+        self.assertEqual(letters[0], "a")
+
+    def test_anneal(self):
+        random.seed(7)
+        board = Board(size=3)
+        board.solve(self.trie)
+        initial_score = board.best_score
+        letters, best_score, evaluations = anneal(self.trie, board, iterations=300)
+        self.assertEqual(evaluations, 300)
+        self.assertGreaterEqual(best_score, initial_score)
+        self.assertEqual(
+            sum(map(score, Board.from_list(letters).all_words(self.trie))), best_score
+        )
+
+        with self.assertRaises(ValueError):
+            anneal(self.trie, board)
+        with self.assertRaises(ValueError):
+            anneal(self.trie, board, iterations=0)
+
+    def test_optimize(self):
+        random.seed(8)
+        with tempfile.TemporaryDirectory() as d:
+            checkpoint = os.path.join(d, "best.json")
+            stderr = sys.stderr
+            sys.stderr = io.StringIO()
+            try:
+                letters, best_score = optimize(
+                    DICTIONARY_EN, size=3, restarts=2, jobs=2, iterations=100,
+                    checkpoint=checkpoint,
+                )
+            finally:
+                sys.stderr = stderr
+
+            with open(checkpoint, "r", encoding="utf-8") as f:
+                saved = json.load(f)["boards"]
+            self.assertEqual(len(saved), 2)
+            self.assertEqual(
+                saved[0], {"board": "".join(letters), "score": best_score}
+            )
+            self.assertGreaterEqual(saved[0]["score"], saved[1]["score"])
+
+            # Resuming with another size and fewer searches keeps the other boards.
+            stderr = sys.stderr
+            sys.stderr = io.StringIO()
+            try:
+                optimize(
+                    DICTIONARY_EN, size=4, restarts=1, jobs=1, iterations=20,
+                    checkpoint=checkpoint,
+                )
+                optimize(
+                    DICTIONARY_EN, size=3, restarts=1, jobs=1, iterations=20,
+                    checkpoint=checkpoint,
+                )
+            finally:
+                sys.stderr = stderr
+
+            with open(checkpoint, "r", encoding="utf-8") as f:
+                resumed = json.load(f)["boards"]
+            sizes = [Board.from_string(entry["board"]).size for entry in resumed]
+            self.assertEqual(sorted(sizes), [3, 3, 4])
+            # Only the best 3x3 board was resumed, and it can only have improved.
+            self.assertIn(saved[1], resumed)
+            scores = [entry["score"] for entry in resumed]
+            self.assertGreaterEqual(max(scores), saved[0]["score"])
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(
+            dictionaries=[DICTIONARY_EN], sizes=[3], boards_per_size=1, repeat=1
+        )
+        benchmarks = [result["benchmark"] for result in results["results"]]
+        self.assertEqual(benchmarks, [
+            "open_dictionary", "trie", "generate_board", "all_words", "check",
+            "all_words", "check",
+        ])
+        solve = results["results"][3]
+        self.assertEqual(solve["size"], "regression")
+        self.assertEqual(solve["boards"], len(BENCHMARK_REGRESSION_BOARDS))
+        self.assertGreater(solve["nodes"], 0)
+        self.assertGreater(solve["peak_bytes"], 0)
+
+    def test_game_server(self):
+        random.seed(9)
+
+        async def play(path):
+            server = GameServer(self.trie, duration=0.5)
+            async with await server.start(path):
+                ann = await asyncio.open_unix_connection(path)
+                bob = await asyncio.open_unix_connection(path)
+                eve = await asyncio.open_unix_connection(path)
+
+                async def send(player, line):
+                    player[1].write(line.encode("utf-8") + b"\n")
+                    return json.loads(await player[0].readline())
+
+                board = await send(ann, "JOIN r1 ann")
+                self.assertEqual(board["type"], "board")
+                self.assertEqual(
+                    (await send(bob, "JOIN r1 bob"))["letters"], board["letters"]
+                )
+                self.assertEqual((await send(eve, "JOIN r1 ann"))["type"], "error")
+
+                word = sorted(server.rooms["r1"].words)[0]
+                self.assertTrue((await send(ann, word))["ok"])
+                again = await send(ann, word)
+                self.assertEqual(again["message"], "You already said that.")
+                self.assertTrue((await send(bob, word))["ok"])
+                self.assertFalse((await send(bob, "qzx"))["ok"])
+                scores = await send(bob, "!s")
+                self.assertEqual(
+                    scores["scores"], {"ann": score(word), "bob": score(word)}
+                )
+
+                end = json.loads(await ann[0].readline())
+                self.assertEqual(end["type"], "end")
+                self.assertEqual(end["words"], {"ann": [word], "bob": [word]})
+                self.assertEqual(await ann[0].readline(), b"")
+                self.assertEqual(server.rooms, {})
+
+                for _, writer in (ann, bob, eve):
+                    writer.close()
+
+                # Players who join while the board is generated share one room.
+                ann = await asyncio.open_unix_connection(path)
+                bob = await asyncio.open_unix_connection(path)
+                boards = await asyncio.gather(
+                    send(ann, "JOIN r2 ann"), send(bob, "JOIN r2 bob")
+                )
+                self.assertEqual(boards[0]["letters"], boards[1]["letters"])
+                self.assertEqual(list(server.rooms), ["r2"])
+                self.assertEqual(server.pending, {})
+
+                # A line longer than the limit of the stream disconnects the player.
+                ann[1].write(b"a" * (1 << 17) + b"\n")
+                self.assertEqual(await ann[0].readline(), b"")
+                self.assertEqual(list(server.rooms["r2"].players), ["bob"])
+
+                # Closing the server disconnects the players that are left.
+                await server.close()
+                self.assertEqual(await bob[0].readline(), b"")
+                self.assertEqual((server.rooms, server.handlers), ({}, set()))
+                for _, writer in (ann, bob):
+                    writer.close()
+
+        with tempfile.TemporaryDirectory() as d:
+            asyncio.run(play(os.path.join(d, "boggle.sock")))
+
+    def test_simulate(self):
+        random.seed(10)
+
+        async def run(path):
+            server = GameServer(self.trie, duration=60)
+            async with await server.start(path):
+                try:
+                    return await simulate(
+                        path, self.trie, players=50, rooms=5, guesses=10
+                    )
+                finally:
+                    await server.close()
+
+        with tempfile.TemporaryDirectory() as d:
+            results = asyncio.run(run(os.path.join(d, "boggle.sock")))
+        self.assertEqual(results["guesses"], 500)
+        self.assertGreater(results["latency_ms"]["max"], 0)
+
+    def test_solver_stats(self):
+        board = Board.from_string("lnigokquiienhbnus")
+        stats = SolverStats()
+        words = board.all_words(self.trie, stats=stats)
+        self.assertEqual(stats.words, len(words))
+        # Every step in the dictionary either leads to a node or is a dead end.
+        self.assertEqual(stats.lookups, stats.nodes + stats.prunes)
+        self.assertGreaterEqual(stats.max_depth, max(map(len, words)))
+        self.assertEqual(list(stats.phases), ["solve"])
+
+        stats = SolverStats()
+        self.assertTrue(board.check("unique", stats=stats))
+        self.assertFalse(board.check("bib", stats=stats))
+        self.assertEqual(stats.words, 1)
+        self.assertEqual(stats.max_depth, 5)
+        self.assertGreater(stats.nodes, 0)
+        json.dumps(stats.as_dict())
+
+    def test_sample_boards(self):
+        with tempfile.TemporaryDirectory() as d:
+            output = os.path.join(d, "distribution.json")
+            random.seed(11)
+            distribution = sample_boards(DICTIONARY_EN, 50, output, size=3, jobs=2)
+            with open(output, "r", encoding="utf-8") as f:
+                self.assertEqual(json.load(f), json.loads(json.dumps(distribution)))
+
+        self.assertEqual(distribution["boards"], 50)
+        for name in ("score", "words", "longest_word"):
+            self.assertEqual(sum(distribution["histograms"][name].values()), 50)
+            percentiles = list(distribution["percentiles"][name].values())
+            self.assertEqual(percentiles, sorted(percentiles))
+
+        # The boards depend only on the seed, not on how many processes solve them.
+        random.seed(11)
+        self.assertEqual(sample_boards(DICTIONARY_EN, 50, size=3), distribution)
+
+        # Sampling in this process only draws the seed from the caller's generator.
+        state = random.getstate()
+        random.getrandbits(64)
+        expected = random.random()
+        random.setstate(state)
+        sample_boards(DICTIONARY_EN, 10, size=3)
+        self.assertEqual(random.random(), expected)
+
+    def test_canonical(self):
+        board = Board.from_string("abcdefghi")
+        symmetries = [
+            "abcdefghi", "gdahebifc", "ihgfedcba", "cfibehadg",
+            "cbafedihg", "adgbehcfi", "ghidefabc", "ifchebgda",
+        ]
+        for letters in symmetries:
+            other = Board.from_string(letters)
+            self.assertEqual(other.canonical(), tuple("abcdefghi"))
+            self.assertEqual(other.all_words(self.trie), board.all_words(self.trie))
+        # Only corners can come first, and "a" isn't in one.
+        self.assertEqual(
+            Board.from_string("dbcaefghi").canonical(), tuple("cbdfeaihg")
+        )
+
+    def test_solution_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            cache = SolutionCache(DICTIONARY_EN, capacity=2, directory=d)
+            board = Board.from_string("ezoaltarnelktsib")
+            words = cache.words(board, self.trie)
+            self.assertEqual(words, board.all_words(self.trie))
+            turned = Board.from_list(
+                [board.letters[(3 - c) * 4 + r] for r in range(4) for c in range(4)]
+            )
+            self.assertIs(cache.words(turned, self.trie), words)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            cache.words(Board.from_string("abcdefghi"), self.trie)
+            cache.words(turned, self.trie)
+            cache.words(Board.from_string("xxxxxxxxx"), self.trie)
+            self.assertEqual(len(cache), 2)
+            self.assertIsNotNone(cache.get(board))
+            self.assertIsNone(cache.get(Board.from_string("abcdefghi")))
+
+            cache.save()
+            cache = SolutionCache(DICTIONARY_EN, capacity=2, directory=d)
+            self.assertEqual(cache.get(board), words)
+            other = SolutionCache(DICTIONARY_EN, min_length=4, directory=d)
+            self.assertEqual(len(other), 0)
+
+            # Nor are solutions shared by different dictionaries of the same name, or
+            # by versions of the same dictionary.
+            dictionary = os.path.join(d, "words", os.path.basename(DICTIONARY_EN))
+            os.makedirs(os.path.dirname(dictionary))
+            shutil.copyfile(DICTIONARY_EN, dictionary)
+            other = SolutionCache(dictionary, directory=d)
+            self.assertEqual(len(other), 0)
+            other.put(board, words)
+            other.save()
+            self.assertEqual(len(SolutionCache(dictionary, directory=d)), 1)
+            with open(dictionary, "a", encoding="utf-8") as f:
+                f.write("zzz\n")
+            self.assertEqual(len(SolutionCache(dictionary, directory=d)), 0)
+
+    def test_blanks(self):
+        random.seed(13)
+        board = Board(size=4, blanks=2)
+        self.assertEqual(board.letters.count(BLANK_TILE), 2)
+
+        board = Board.from_list(list("c?tsaxzzz"))
+        self.assertTrue(board.check("cat"))
+        self.assertTrue(board.check("cut"))
+        self.assertTrue(board.check("tic"))
+        self.assertFalse(board.check("cob"))
+        self.assertIn("scat", board.all_words(self.trie))
+        self.assertIn("quit", Board.from_string("?itsxxxxx").all_words(self.trie))
+
+        # With one blank, the words are those of the boards with any letter in its
+        # place.
+        for _ in range(3):
+            board = Board(size=4, blanks=1)
+            words = board.all_words(self.trie)
+            expected = set()
+            for tile in ALPHABET_EN.tiles:
+                letters = [tile if t == BLANK_TILE else t for t in board.letters]
+                expected |= Board.from_list(letters).all_words(self.trie)
+            self.assertEqual(words, expected)
+            for word in words:
+                self.assertTrue(board.check(word))
+
+            board.solve(self.trie)
+            self.assertEqual(set(board.words), words)
+            board.replace(board.letters.index(BLANK_TILE), "e")
+            board.replace(0, BLANK_TILE)
+            self.assertEqual(set(board.words), board.all_words(self.trie))
+
+    def test_bounded_queries(self):
+        board = Board.from_string("lnigokquiienhbnus")
+        words = board.all_words(self.trie)
+        found = list(board.iter_words(self.trie))
+        self.assertEqual(len(found), len(set(found)))
+        self.assertEqual(set(found), words)
+
+        longest = board.top_words(self.trie, 5, by="length")
+        self.assertEqual(len(longest), 5)
+        self.assertEqual(
+            [len(word) for word in longest],
+            sorted(map(len, words), reverse=True)[:5],
+        )
+        best = board.top_words(self.trie, 3)
+        self.assertEqual(
+            [score(word) for word in best],
+            sorted(map(score, words), reverse=True)[:3],
+        )
+        self.assertEqual(board.top_words(self.trie, len(words) + 1), sorted(
+            words, key=lambda word: (score(word), word), reverse=True
+        ))
+        with self.assertRaises(ValueError):
+            board.top_words(self.trie, 1, by="vowels")
+
+        total = sum(map(score, words))
+        self.assertTrue(board.reaches_score(self.trie, total))
+        self.assertFalse(board.reaches_score(self.trie, total + 1))
+        self.assertTrue(board.has_words(self.trie))
+        self.assertFalse(Board.from_string("xxxxxxxxx").has_words(self.trie))
+
+    def test_check_guess(self):
+        board = Board.from_string("ezoaltarnelktsib")
+        words = board.all_words(self.trie)
+        # Before the board is solved, guesses are checked with the trie instead.
+        for solution in (words, None):
+            def check(guess):
+                return check_guess(board, solution, guess, trie=self.trie)
+
+            self.assertIsNone(check("blaze"))
+            self.assertEqual(check("at"), "Too short. (minimum length: 3)")
+            self.assertEqual(check("zebra"), "Not on the board.")
+            self.assertEqual(check("ezo"), "Not in dictionary.")
+
+    def test_run_in_background(self):
+        board = Board.from_string("ezoaltarnelktsib")
+        future = run_in_background(board.all_words, self.trie, min_length=4)
+        self.assertEqual(future.result(), board.all_words(self.trie, min_length=4))
+
+        future = run_in_background(generate_board, self.trie, Difficulty(max_score=-1))
+        with self.assertRaises(ValueError):
+            future.result()
+
+    @unittest.skipIf(np is None, "requires NumPy")
+    def test_solve_boards(self):
+        random.seed(14)
+        for size in (3, 4, 5, 9):
+            boards = [Board(size=size) for _ in range(20)]
+            boards[3] = Board(size=size, blanks=1)
+            self.assertEqual(
+                solve_boards(self.trie, boards),
+                [board.all_words(self.trie) for board in boards],
+            )
+
+        boards = [Board.from_string(b) for b in BENCHMARK_REGRESSION_BOARDS[:2]]
+        self.assertEqual(
+            solve_boards(self.trie, boards, min_length=5),
+            [board.all_words(self.trie, min_length=5) for board in boards],
+        )
+        self.assertEqual(solve_boards(self.trie, []), [])
+        with self.assertRaises(ValueError):
+            solve_boards(self.trie, [Board(size=3), Board(size=4)])
+
+        # Boards without a single prefix of a word.
+        boards = [Board.from_string("ё" * 9), Board.from_string("ё" * 9)]
+        self.assertEqual(solve_boards(self.trie, boards), [set(), set()])
+        self.assertEqual(solve_boards(Trie([]), [Board(size=3)]), [set()])
+
+    def test_trie_max_length(self):
+        self.assertEqual(Trie(["cat", "cats", "dog"]).max_length, 4)
+        self.assertEqual(Trie(["dog", "a", "bee"]).max_length, 3)
+        self.assertEqual(Trie([]).max_length, 0)
+        self.assertEqual(self.trie.max_length, max(map(len, self.dct)))
+
+    def test_all_words_max_length(self):
+        board = Board.from_list(list("lnigok") + ["qu"] + list("iienhbnus"))
+        words = board.all_words(self.trie)
+        self.assertEqual(
+            board.all_words(self.trie, max_length=5),
+            {word for word in words if len(word) <= 5},
+        )
+        self.assertIn("unique", board.all_words(self.trie, max_length=6))
+
+    def test_all_words_large_board(self):
+        random.seed(100)
+        board = Board(size=40)
+        words = board.all_words(self.trie)
+        self.assertEqual(board.check("bib"), "bib" in words)
+        for word in random.sample(sorted(words), 50):
+            self.assertTrue(board.check(word))
+
+    def test_all_words_matches_dictionary(self):
+        # Every word found must be in the dictionary and on the board, and every word
+        # in the dictionary that is on the board must be found.
+        random.seed(1930)
+        board = Board(size=5)
+        words = board.all_words(self.trie)
+        expected = {
+            word for word in self.dct
+            if len(word) >= MIN_WORD_LENGTH and board.check(word)
+        }
+        self.assertEqual(words, expected)
+
 
 if __name__ == "__main__":
     if len(sys.argv) == 2 and sys.argv[1] == "--test":
@@ -14,11 +14,72 @@ with the usual precedence.
 
 Version: January 2019
 """
-from collections import namedtuple
+import bisect
+import math
+import operator
+import pickle
+import re
+import sys
+from array import array
+from collections import OrderedDict, namedtuple
+
+# NumPy is optional, and only needed for evaluate_columns.
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 def parse(text):
-    return MiniParser(MiniLexer(text)).parse()
+    return MiniParser(RegexLexer(text)).parse()
+
+
+def parse_arena(text):
+    """Parse the text into a NodeArena, whose root attribute is the id of the root of
+    the syntax tree.
+    """
+    arena = NodeArena()
+    ArenaParser(RegexLexer(text), arena).parse()
+    return arena
+
+
+def parse_cached(text):
+    """Like parse, but the results are cached in PARSE_CACHE, and equal subtrees are the
+    same object (see ParseCache).
+    """
+    return PARSE_CACHE.parse(text)
+
+
+def compile_expr(tree):
+    """Compile the syntax tree into a Python function, which takes a mapping from
+    symbols to values and a mapping from function names to functions, and returns the
+    value of the expression.
+    """
+    return ExprCompiler().compile(tree)
+
+
+def evaluate_columns(tree, columns, functions=None):
+    """Evaluate the expression for every row of a table at once.
+
+    The columns are a mapping from symbols to NumPy arrays (or anything np.asarray
+    accepts) of the same length, and the result is an array with the value of the
+    expression for each row. Calls are looked up in the functions, and then in
+    VECTOR_FUNCTIONS, and should take and return arrays.
+    """
+    if np is None:
+        raise ImportError("evaluate_columns requires NumPy")
+
+    if functions is not None:
+        functions = dict(VECTOR_FUNCTIONS, **functions)
+    else:
+        functions = VECTOR_FUNCTIONS
+    columns = {symbol: np.asarray(column) for symbol, column in columns.items()}
+
+    result = np.asarray(compile_expr(tree)(columns, functions))
+    if result.ndim == 0 and columns:
+        # The expression doesn't depend on any column.
+        result = np.full(len(next(iter(columns.values()))), result)
+    return result
 
 
 class MiniParser:
@@ -55,10 +116,10 @@ class MiniParser:
         """Match a non-infix expression."""
         tkn = self.lexer.tkn
         if tkn.type == TOKEN_INT:
-            left = IntNode(int(tkn.value))
+            left = self.int_node(int(tkn.value))
             self.lexer.next_token()
         elif tkn.type == TOKEN_SYMBOL:
-            left = SymbolNode(tkn.value)
+            left = self.symbol_node(tkn.value)
             self.lexer.next_token()
         elif tkn.type == TOKEN_LPAREN:
             self.lexer.next_token()
@@ -67,7 +128,7 @@ class MiniParser:
             self.lexer.next_token()
         elif tkn.type == TOKEN_MINUS:
             self.lexer.next_token()
-            left = PrefixNode("-", self.match_expr(PREC_PREFIX))
+            left = self.prefix_node("-", self.match_expr(PREC_PREFIX))
 
         return left
 
@@ -80,10 +141,10 @@ class MiniParser:
             arglist = self.match_arglist()
             self.expect(TOKEN_RPAREN)
             self.lexer.next_token()
-            return CallNode(left, arglist)
+            return self.call_node(left, arglist)
         else:
             right = self.match_expr(prec)
-            return InfixNode(tkn.value, left, right)
+            return self.infix_node(tkn.value, left, right)
 
     def match_arglist(self):
         """Match the argument list of a call expression."""
@@ -106,10 +167,62 @@ class MiniParser:
             elif self.lexer.tkn.type == TOKEN_EOF:
                 raise SyntaxError("premature end of input")
             else:
+                line, column = self.lexer.location(self.lexer.tkn)
                 raise SyntaxError(
-                    "unexpected token, line {0.line} col {0.col}".format(self.lexer.tkn)
+                    "unexpected token, line {} col {}".format(line, column)
                 )
 
+    # The methods below create the nodes of the syntax tree, and subclasses may override
+    # them to build the tree differently.
+
+    def int_node(self, value):
+        return IntNode(value)
+
+    def symbol_node(self, value):
+        return SymbolNode(value)
+
+    def call_node(self, f, arglist):
+        return CallNode(f, arglist)
+
+    def infix_node(self, op, left, right):
+        return InfixNode(op, left, right)
+
+    def prefix_node(self, op, arg):
+        return PrefixNode(op, arg)
+
+
+class ArenaParser(MiniParser):
+    """A parser that stores the syntax tree in a NodeArena instead of creating an object
+    for each node, so the match_* methods return node ids rather than nodes.
+    """
+
+    def __init__(self, lexer, arena):
+        super().__init__(lexer)
+        self.arena = arena
+
+    def parse(self):
+        self.arena.root = super().parse()
+        return self.arena.root
+
+    def int_node(self, value):
+        return self.arena.add(KIND_INT, value=value)
+
+    def symbol_node(self, value):
+        return self.arena.add(KIND_SYMBOL, value=value)
+
+    def call_node(self, f, arglist):
+        # The arguments of a call are stored contiguously in the arena's arguments
+        # array, and the node's right child is the offset of the first one.
+        offset = len(self.arena.arguments)
+        self.arena.arguments.extend(arglist)
+        return self.arena.add(KIND_CALL, left=f, right=offset, value=len(arglist))
+
+    def infix_node(self, op, left, right):
+        return self.arena.add(KIND_INFIX, op=op, left=left, right=right)
+
+    def prefix_node(self, op, arg):
+        return self.arena.add(KIND_PREFIX, op=op, left=arg)
+
 
 class IntNode(namedtuple("IntNode", ["value"])):
     def __str__(self):
@@ -125,6 +238,10 @@ class CallNode(namedtuple("CallNode", ["f", "arglist"])):
     def __str__(self):
         return "{}({})".format(wrap(self.f), ", ".join(map(str, self.arglist)))
 
+    def __hash__(self):
+        # The arglist is a list, so it's hashed as a tuple.
+        return hash((self.f, tuple(self.arglist)))
+
 
 class InfixNode(namedtuple("InfixNode", ["op", "left", "right"])):
     def __str__(self):
@@ -136,6 +253,447 @@ class PrefixNode(namedtuple("PrefixNode", ["op", "arg"])):
         return str(self.op) + wrap(self.arg)
 
 
+class NodeArena:
+    """A syntax tree stored as parallel arrays of machine integers, indexed by node id.
+
+    This takes a small fraction of the memory of a tree of node objects. The columns
+    are:
+
+        kind   one of the KIND_* constants
+        op     the index of the node's operator in OPERATORS, or -1
+        left   the id of the left child, the operand of a prefix expression, or the
+               function of a call expression, or -1
+        right  the id of the right child, or for a call expression the offset of its
+               first argument in the arguments array, or -1
+        value  the index of the node's value in the values list, or for a call
+               expression the number of its arguments, or -1
+
+    Equal values are stored only once in the values list. The node method creates the
+    usual node objects from the arena, but only for the subtree that is asked for.
+    """
+
+    def __init__(self):
+        self.kind = array("b")
+        self.op = array("b")
+        self.left = array("i")
+        self.right = array("i")
+        self.value = array("i")
+        self.arguments = array("i")
+        self.values = []
+        self.value_index = {}
+        self.root = -1
+
+    def __len__(self):
+        return len(self.kind)
+
+    def add(self, kind, *, op=None, left=-1, right=-1, value=None):
+        """Add a node to the arena and return its id.
+
+        For call expressions, the value is the number of arguments rather than a value
+        to store.
+        """
+        if kind == KIND_CALL:
+            value_id = value
+        elif value is None:
+            value_id = -1
+        else:
+            # Keyed on the type as well, since True == 1 and so on.
+            key = (type(value), value)
+            value_id = self.value_index.get(key)
+            if value_id is None:
+                value_id = self.value_index[key] = len(self.values)
+                self.values.append(value)
+
+        self.kind.append(kind)
+        self.op.append(-1 if op is None else OPERATORS.index(op))
+        self.left.append(left)
+        self.right.append(right)
+        self.value.append(value_id)
+        return len(self.kind) - 1
+
+    def node(self, node_id=None):
+        """Return the subtree rooted at the node id (by default, the root) as node
+        objects.
+        """
+        if node_id is None:
+            node_id = self.root
+
+        # The subtree is built bottom-up with an explicit stack rather than recursively,
+        # so that deep trees can be built as well as parsed. Each node id is pushed once
+        # to push its children, and again to build its node.
+        nodes = {}
+        stack = [(node_id, False)]
+        while stack:
+            i, ready = stack.pop()
+            kind = self.kind[i]
+            if kind == KIND_INT:
+                nodes[i] = IntNode(self.values[self.value[i]])
+            elif kind == KIND_SYMBOL:
+                nodes[i] = SymbolNode(self.values[self.value[i]])
+            elif not ready:
+                stack.append((i, True))
+                stack.extend((child, False) for child in self.children(i))
+            elif kind == KIND_CALL:
+                offset = self.right[i]
+                arglist = self.arguments[offset:offset+self.value[i]]
+                nodes[i] = CallNode(
+                    nodes[self.left[i]], [nodes[arg] for arg in arglist]
+                )
+            elif kind == KIND_INFIX:
+                nodes[i] = InfixNode(
+                    OPERATORS[self.op[i]], nodes[self.left[i]], nodes[self.right[i]]
+                )
+            else:
+                nodes[i] = PrefixNode(OPERATORS[self.op[i]], nodes[self.left[i]])
+        return nodes[node_id]
+
+    def children(self, node_id):
+        """Return the ids of the children of the node."""
+        kind = self.kind[node_id]
+        if kind == KIND_CALL:
+            offset = self.right[node_id]
+            arglist = self.arguments[offset:offset+self.value[node_id]]
+            return [self.left[node_id]] + arglist.tolist()
+        elif kind == KIND_INFIX:
+            return [self.left[node_id], self.right[node_id]]
+        elif kind == KIND_PREFIX:
+            return [self.left[node_id]]
+        else:
+            return []
+
+
+KIND_INT    = 0
+KIND_SYMBOL = 1
+KIND_CALL   = 2
+KIND_INFIX  = 3
+KIND_PREFIX = 4
+
+OPERATORS = ["+", "-", "*", "/"]
+
+
+class InterningParser(MiniParser):
+    """A parser that hash-conses the syntax tree: it looks up each node it creates in a
+    dictionary of nodes, and returns the existing node instead if there is an equal
+    one.
+
+    Since the children of a node are already interned, nodes are looked up by the ids
+    of their children, which takes constant time. For the same reason, the hash of a
+    new node is computed from the cached hashes of its children and cached in turn, so
+    the nodes are instances of subclasses of the node classes (see InternedNode).
+    The nodes are shared, so they (including the arglists of calls) must not be
+    changed.
+    """
+
+    def __init__(self, lexer, nodes):
+        super().__init__(lexer)
+        self.nodes = nodes
+
+    def intern(self, key, node):
+        existing = self.nodes.get(key)
+        if existing is not None:
+            return existing
+        node.hash = super(InternedNode, node).__hash__()
+        self.nodes[key] = node
+        return node
+
+    def int_node(self, value):
+        return self.intern((IntNode, value), InternedIntNode(value))
+
+    def symbol_node(self, value):
+        return self.intern((SymbolNode, value), InternedSymbolNode(value))
+
+    def call_node(self, f, arglist):
+        key = (CallNode, id(f)) + tuple(map(id, arglist))
+        return self.intern(key, InternedCallNode(f, arglist))
+
+    def infix_node(self, op, left, right):
+        key = (InfixNode, op, id(left), id(right))
+        return self.intern(key, InternedInfixNode(op, left, right))
+
+    def prefix_node(self, op, arg):
+        key = (PrefixNode, op, id(arg))
+        return self.intern(key, InternedPrefixNode(op, arg))
+
+
+class InternedNode:
+    """The base class of the nodes that InterningParser creates, whose hash is cached in
+    their hash attribute. They are equal to the nodes that parse returns, and are
+    pickled as those nodes.
+    """
+
+    def __hash__(self):
+        return self.hash
+
+    def __reduce__(self):
+        # The node class that this is a subclass of.
+        return (type(self).__bases__[-1], tuple(self))
+
+
+class InternedIntNode(InternedNode, IntNode):
+    pass
+
+
+class InternedSymbolNode(InternedNode, SymbolNode):
+    pass
+
+
+class InternedCallNode(InternedNode, CallNode):
+    pass
+
+
+class InternedInfixNode(InternedNode, InfixNode):
+    pass
+
+
+class InternedPrefixNode(InternedNode, PrefixNode):
+    pass
+
+
+class ParseCache:
+    """A bounded cache of syntax trees, keyed on the text that was parsed.
+
+    The cache holds the trees of at most `capacity` texts, and forgets the least
+    recently used texts first. The trees are equal to those that parse returns, but
+    they are built by an InterningParser, so equal subtrees of all the trees in the
+    cache are the same object and can be compared with `is`. Comparing trees with ==
+    stops at the shared subtrees, and hashing them takes constant time. The nodes are
+    never changed and must not be.
+
+    To bound the memory of the interned nodes too, the whole cache is cleared when
+    there are more than `max_nodes` of them.
+    """
+
+    def __init__(self, capacity=4096, max_nodes=1 << 20):
+        self.capacity = capacity
+        self.max_nodes = max_nodes
+        self.hits = 0
+        self.misses = 0
+        # Map from text to tree, in order from least to most recently used.
+        self.entries = OrderedDict()
+        # Map from the keys of InterningParser to nodes.
+        self.nodes = {}
+
+    def parse(self, text):
+        tree = self.entries.get(text)
+        if tree is not None:
+            self.hits += 1
+            self.entries.move_to_end(text)
+            return tree
+
+        self.misses += 1
+        if len(self.nodes) > self.max_nodes:
+            self.clear()
+        tree = InterningParser(RegexLexer(text), self.nodes).parse()
+        self.entries[text] = tree
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return tree
+
+    def clear(self):
+        self.entries.clear()
+        self.nodes.clear()
+
+
+class ExprCompiler:
+    """The compiler from syntax trees to Python functions.
+
+    The tree is first turned into a list of operations, in which equal subexpressions
+    are the same operation (so they are only evaluated once, including calls with equal
+    arguments) and operations on constants are folded. The operations are then written
+    out as the source of a Python function: symbols and functions are looked up once at
+    the start, operations that are used more than once are stored in local variables,
+    and everything else is written inline. Constants are passed to the function in a
+    closure rather than written out, since not every value (e.g., inf) has a literal.
+    """
+
+    # Subexpressions nested deeper than this are stored in local variables, to keep
+    # within the limits of the Python parser.
+    MAX_INLINE_DEPTH = 50
+
+    def __init__(self):
+        # Each operation is a tuple whose first element is one of "const", "load",
+        # "function", "infix", "prefix" or "call", and whose other elements are values,
+        # names, operators and the indices of other operations.
+        self.operations = []
+        self.index = {}
+
+    def compile(self, tree):
+        root = self.add_node(tree)
+        source, constants = self.write_source(root)
+        namespace = {}
+        exec(compile(source, "<expression>", "exec"), namespace)
+        evaluate = namespace["make_evaluate"](constants)
+        evaluate.source = source
+        return evaluate
+
+    def add_node(self, tree):
+        """Add the operations for the tree and return the index of its result.
+
+        The tree is walked with an explicit stack rather than recursively, so that deep
+        trees can be compiled as well as parsed.
+        """
+        # Map from the ids of the nodes that have been added to the indices of their
+        # results, and from the ids of calls of named functions to the indices of the
+        # functions.
+        results = {}
+        functions = {}
+        # Each node is pushed once to add its children, and again to add itself.
+        stack = [(tree, False)]
+        while stack:
+            node, ready = stack.pop()
+            if id(node) in results:
+                continue
+
+            if isinstance(node, IntNode):
+                results[id(node)] = self.add("const", node.value)
+            elif isinstance(node, SymbolNode):
+                results[id(node)] = self.add("load", node.value)
+            elif not ready:
+                if isinstance(node, CallNode) and isinstance(node.f, SymbolNode):
+                    functions[id(node)] = self.add("function", node.f.value)
+                stack.append((node, True))
+                # Reversed, so that the children are added from left to right.
+                for child in reversed(self.children(node)):
+                    stack.append((child, False))
+            elif isinstance(node, InfixNode):
+                left, right = results[id(node.left)], results[id(node.right)]
+                results[id(node)] = self.add_folded(node.op, left, right)
+            elif isinstance(node, PrefixNode):
+                results[id(node)] = self.add_folded(node.op, results[id(node.arg)])
+            else:
+                f = functions.get(id(node))
+                if f is None:
+                    f = results[id(node.f)]
+                args = [results[id(arg)] for arg in node.arglist]
+                results[id(node)] = self.add("call", f, *args)
+        return results[id(tree)]
+
+    def children(self, node):
+        """Return the child nodes that add_node must add before the node."""
+        if isinstance(node, InfixNode):
+            return [node.left, node.right]
+        elif isinstance(node, PrefixNode):
+            return [node.arg]
+        elif isinstance(node.f, SymbolNode):
+            return list(node.arglist)
+        else:
+            return [node.f] + list(node.arglist)
+
+    def add_folded(self, op, *operands):
+        """Add an infix or prefix operation, or its value if the operands are
+        constants.
+        """
+        kind = "infix" if len(operands) == 2 else "prefix"
+        if all(self.operations[i][0] == "const" for i in operands):
+            values = [self.operations[i][1] for i in operands]
+            try:
+                value = FOLDERS[kind][op](*values)
+            except ArithmeticError:
+                # E.g., division by zero, which is left to raise when evaluated.
+                pass
+            else:
+                return self.add("const", value)
+        return self.add(kind, op, *operands)
+
+    def add(self, *operation):
+        """Add the operation if it's not already there, and return its index."""
+        # The type is part of the key because 1 == 1.0 and so on.
+        key = operation + (type(operation[1]),)
+        if operation[0] == "const" and isinstance(operation[1], float):
+            # Likewise 0.0 == -0.0, but they can give different results.
+            key += (math.copysign(1, operation[1]),)
+        i = self.index.get(key)
+        if i is None:
+            i = self.index[key] = len(self.operations)
+            self.operations.append(operation)
+        return i
+
+    def write_source(self, root):
+        """Return the source of a function make_evaluate, which takes a tuple of
+        constants and returns the compiled function, along with the constants.
+        """
+        uses = self.count_uses(root)
+        names = {}
+        depths = {}
+        constants = {}
+        lines = []
+        for i in sorted(uses):
+            operation = self.operations[i]
+            if operation[0] == "const":
+                names[i] = "_{}".format(i)
+                constants[names[i]] = operation[1]
+                continue
+            elif operation[0] in ("load", "function"):
+                table = "bindings" if operation[0] == "load" else "functions"
+                names[i] = "_{}".format(i)
+                lines.append("    _{} = {}[{!r}]".format(i, table, operation[1]))
+                continue
+
+            depths[i] = 1 + max(
+                (depths.get(j, 0) for j in self.operands(i) if j not in names),
+                default=0,
+            )
+            if i != root and (uses[i] > 1 or depths[i] > self.MAX_INLINE_DEPTH):
+                lines.append("    _{} = {}".format(i, self.write(i, names)))
+                names[i] = "_{}".format(i)
+
+        lines.append("    return {}".format(self.write(root, names)))
+
+        header = ["def make_evaluate(constants):"]
+        if constants:
+            header.append("    {}, = constants".format(", ".join(constants)))
+        header.append("    def evaluate(bindings, functions):")
+        lines = header + ["    " + line for line in lines] + ["    return evaluate"]
+        return "\n".join(lines) + "\n", tuple(constants.values())
+
+    def count_uses(self, root):
+        """Return a dictionary from the index of each operation that the root depends
+        on to the number of operations that use it.
+        """
+        uses = {root: 1}
+        stack = [root]
+        while stack:
+            for j in self.operands(stack.pop()):
+                if j not in uses:
+                    uses[j] = 0
+                    stack.append(j)
+                uses[j] += 1
+        return uses
+
+    def operands(self, i):
+        """Return the indices of the operations that operation i uses."""
+        operation = self.operations[i]
+        if operation[0] in ("infix", "prefix"):
+            return operation[2:]
+        elif operation[0] == "call":
+            return operation[1:]
+        else:
+            return ()
+
+    def write(self, i, names):
+        """Return the Python source of operation i, given the local variable names of
+        the operations that have them.
+        """
+        def operand(j):
+            if j in names:
+                return names[j]
+            else:
+                return "({})".format(self.write(j, names))
+
+        operation = self.operations[i]
+        if i in names:
+            return names[i]
+        elif operation[0] == "infix":
+            _, op, left, right = operation
+            return "{} {} {}".format(operand(left), op, operand(right))
+        elif operation[0] == "prefix":
+            _, op, arg = operation
+            return op + operand(arg)
+        else:
+            f, *args = operation[1:]
+            return "{}({})".format(operand(f), ", ".join(map(operand, args)))
+
+
 class MiniLexer:
     """The lexer for the expression mini-language.
 
@@ -215,8 +773,49 @@ class MiniLexer:
         for _ in range(length):
             self.next_char()
 
+    def location(self, tkn):
+        """Return the line and column of the token."""
+        return tkn.line, tkn.column
+
+
+class RegexLexer:
+    """A faster lexer for the expression mini-language, with the same interface as
+    MiniLexer.
+
+    Each token, along with the whitespace before it, is recognized by one match of
+    TOKEN_REGEX, whose named groups are the token types. Tokens only record their
+    offset in the text: their line and column are worked out from the offsets of the
+    newlines in the text, and only when the location method is called (e.g., for an
+    error message).
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.position = 0
+        self.newlines = None
+        # Set the current token.
+        self.next_token()
+
+    def next_token(self):
+        match = TOKEN_REGEX.match(self.text, self.position)
+        typ = match.lastgroup
+        self.tkn = OffsetToken(typ, match.group(typ), match.start(typ))
+        self.position = match.end()
+        return self.tkn
+
+    def location(self, tkn):
+        """Return the line and column of the token."""
+        if self.newlines is None:
+            self.newlines = [m.start() for m in re.finditer("\n", self.text)]
+
+        # The number of newlines before the token.
+        line = bisect.bisect_left(self.newlines, tkn.position)
+        line_start = self.newlines[line - 1] + 1 if line > 0 else 0
+        return line + 1, tkn.position - line_start + 1
+
 
 Token = namedtuple("Token", ["type", "value", "line", "column"])
+OffsetToken = namedtuple("OffsetToken", ["type", "value", "position"])
 
 
 TOKEN_INT      = "TOKEN_INT"
@@ -232,6 +831,26 @@ TOKEN_EOF      = "TOKEN_EOF"
 TOKEN_UNKNOWN  = "TOKEN_UNKNOWN"
 
 
+# Whitespace followed by one token. The name of each group is the type of the token it
+# matches, and the groups are tried in order.
+TOKEN_REGEX = re.compile(
+    r"""\s*(?:
+        (?P<TOKEN_SYMBOL>[^\W\d]\w*)
+      | (?P<TOKEN_INT>\d+)
+      | (?P<TOKEN_LPAREN>\()
+      | (?P<TOKEN_RPAREN>\))
+      | (?P<TOKEN_COMMA>,)
+      | (?P<TOKEN_PLUS>\+)
+      | (?P<TOKEN_ASTERISK>\*)
+      | (?P<TOKEN_MINUS>-)
+      | (?P<TOKEN_SLASH>/)
+      | (?P<TOKEN_EOF>\Z)
+      | (?P<TOKEN_UNKNOWN>.)
+    )""",
+    re.VERBOSE | re.DOTALL,
+)
+
+
 PREC_LOWEST = 0
 PREC_ADD_SUB = 1
 PREC_MUL_DIV = 2
@@ -247,6 +866,37 @@ PREC_MAP = {
     TOKEN_LPAREN:   PREC_CALL,
 }
 
+# The functions used to fold operations on constants, by kind and operator.
+FOLDERS = {
+    "infix": {
+        "+": operator.add,
+        "-": operator.sub,
+        "*": operator.mul,
+        "/": operator.truediv,
+    },
+    "prefix": {
+        "-": operator.neg,
+    },
+}
+
+# The functions that evaluate_columns makes available to expressions.
+if np is not None:
+    VECTOR_FUNCTIONS = {
+        "abs": np.abs,
+        "ceil": np.ceil,
+        "exp": np.exp,
+        "floor": np.floor,
+        "log": np.log,
+        "log10": np.log10,
+        "max": np.maximum,
+        "min": np.minimum,
+        "sqrt": np.sqrt,
+    }
+else:
+    VECTOR_FUNCTIONS = {}
+
+PARSE_CACHE = ParseCache()
+
 
 def wrap(node):
     """Stringify the parse tree node and wrap it in parentheses if it might be
@@ -268,4 +918,141 @@ assert str(parse("1*2+3")) == "(1 * 2) + 3"
 assert str(parse("(1+2)*3")) == "(1 + 2) * 3"
 assert str(parse("f(1, 2, 3)")) == "f(1, 2, 3)"
 assert str(parse("-f(1+2, 3)/4")) == "(-f(1 + 2, 3)) / 4"
+
+
+def tokens(lexer):
+    """Return the list of (type, value) pairs of the lexer's tokens."""
+    pairs = [(lexer.tkn.type, lexer.tkn.value)]
+    while lexer.tkn.type != TOKEN_EOF:
+        lexer.next_token()
+        pairs.append((lexer.tkn.type, lexer.tkn.value))
+    return pairs
+
+
+def test_extensions():
+    """Test the lexer, the arena, the compiler and the parse cache."""
+    # Just deeper than the recursion limit.
+    depth = sys.getrecursionlimit() + 100
+    deep = " + ".join("x" for _ in range(depth))
+
+    for text in ["", "  ", "f(x_1, 23) * -y / 4", "a\n +\tb2 ? 1_000(", "\n\n  )"]:
+        assert tokens(RegexLexer(text)) == tokens(MiniLexer(text))
+
+    lexer = RegexLexer("1 +\n  foo(\n\n bar)")
+    for _ in range(4):
+        lexer.next_token()
+    assert lexer.tkn.value == "bar"
+    assert lexer.location(lexer.tkn) == (4, 2)
+    assert lexer.location(OffsetToken(TOKEN_INT, "1", 0)) == (1, 1)
+
+    try:
+        parse("1 +\n 2 3")
+    except SyntaxError as e:
+        assert str(e) == "trailing input"
+    else:
+        assert False
+    try:
+        parse("f(1,\n  2 3)")
+    except SyntaxError as e:
+        assert str(e) == "unexpected token, line 2 col 5"
+    else:
+        assert False
+
+    text = "-f(x + 1, g(y), 2 * x) / (x + 1)"
+    arena = parse_arena(text)
+    assert arena.node() == parse(text)
+    assert str(arena.node()) == str(parse(text))
+    assert len(arena) == 16
+    # x and 1 are each stored once.
+    assert arena.values == ["f", "x", 1, "g", "y", 2]
+    assert arena.node(arena.left[arena.root]) == parse("-f(x + 1, g(y), 2 * x)")
+    root = arena.root
+    assert arena.children(root) == [arena.left[root], arena.right[root]]
+
+    # Deeper than the recursion limit, so compared by hash rather than with ==.
+    assert hash(parse_arena(deep).node()) == hash(parse(deep))
+
+    evaluate = compile_expr(parse("f(x + 1, 2 * 3) / (x + 1) - -y"))
+    assert evaluate({"x": 1, "y": 2}, {"f": lambda a, b: a * b}) == 8
+    # x + 1 is only computed once, and 2 * 3 is folded.
+    assert evaluate.source.count(" + ") == 1
+    assert " * " not in evaluate.source
+
+    evaluate = compile_expr(parse("-(2 * 3) + 4 / 8"))
+    assert evaluate({}, {}) == -5.5
+    assert "return _" in evaluate.source
+    evaluate = compile_expr(parse("f(x)(y)"))
+    assert evaluate({"x": 1, "y": 2}, {"f": lambda a: a.__add__}) == 3
+    evaluate = compile_expr(parse("g(1) + g(1) + g(2)"))
+    calls = []
+    assert evaluate({}, {"g": lambda a: calls.append(a) or a}) == 4
+    assert calls == [1, 2]
+    try:
+        compile_expr(parse("x / 0"))({"x": 1}, {})
+    except ZeroDivisionError:
+        pass
+    else:
+        assert False
+
+    # Constants without a literal, and constants that are equal but not the same.
+    big = "(1" + "0" * 300 + " / 1)"
+    assert compile_expr(parse(big + " * " + big + " + x"))({"x": 1}, {}) == math.inf
+    evaluate = compile_expr(parse("g(0 / 1, -(0 / 1))"))
+    assert [math.copysign(1, a) for a in evaluate({}, {"g": lambda *a: a})] == [1, -1]
+
+    text = " + ".join("x" for _ in range(500))
+    assert compile_expr(parse(text))({"x": 1}, {}) == 500
+    assert compile_expr(parse(deep))({"x": 1}, {}) == depth
+
+    if np is not None:
+        x = np.arange(5)
+        y = [1.5, 2.0, -1.0, 0.0, 4.0]
+        result = evaluate_columns(parse("max(x, 2) * y - -sqrt(x)"), {"x": x, "y": y})
+        assert np.allclose(result, np.maximum(x, 2) * y + np.sqrt(x))
+        result = evaluate_columns(
+            parse("twice(x) / 2"), {"x": x}, {"twice": lambda column: column * 2}
+        )
+        assert np.array_equal(result, x)
+        assert np.array_equal(evaluate_columns(parse("1 + 2"), {"x": x}), [3] * 5)
+        assert np.array_equal(evaluate_columns(parse(deep), {"x": x}), x * depth)
+    else:
+        try:
+            evaluate_columns(parse("x"), {"x": [1]})
+        except ImportError:
+            pass
+        else:
+            assert False
+
+    cache = ParseCache(capacity=2)
+    tree = cache.parse("f(x + 1, -y) * (x + 1)")
+    assert str(tree) == str(parse("f(x + 1, -y) * (x + 1)"))
+    assert tree.left.arglist[0] is tree.right
+    assert cache.parse("f(x + 1, -y) * (x + 1)") is tree
+    assert cache.parse("(x + 1) / 2").left is tree.right
+    cache.parse("3")
+    # The text was evicted, but the tree is still interned.
+    assert cache.parse("f(x + 1, -y) * (x + 1)") is tree
+    assert (cache.hits, cache.misses) == (1, 4)
+    try:
+        cache.parse("f(1")
+    except SyntaxError:
+        pass
+    else:
+        assert False
+
+    cache = ParseCache()
+    assert cache.parse("-x") is cache.parse("-x")
+    for text in ["f(x, 1)", "g(f(x, 1)) * -f(x, 1)"]:
+        assert cache.parse(text) == parse(text)
+        assert hash(cache.parse(text)) == hash(parse(text))
+        assert "hash" in cache.parse(text).__dict__
+    assert cache.parse("f(x, 1)") in {parse("f(x, 1)")}
+    assert pickle.loads(pickle.dumps(cache.parse("f(x + 1, -y) * 2"))) == parse(
+        "f(x + 1, -y) * 2"
+    )
+    assert type(pickle.loads(pickle.dumps(cache.parse("x")))) is SymbolNode
+    assert hash(parse(deep)) == hash(cache.parse(deep))
+
+
+test_extensions()
 print("Test suite passed!")